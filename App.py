@@ -1,17 +1,14 @@
-import datetime
-import json
-import os
-
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import *
 
 from AppGUI import Widgets
 from Drive import GoogleDriveClient
-
-app = QApplication([])
+from Settings import (CHECKPOINT_FILE, DOWNLOAD_JOURNAL_FILE, FOLDER_CACHE_FILE, INDEX_DIRECTORY, METRICS_FILE,
+                      load_cache)
 
 
 def run():
+    app = QApplication([])
     style = """
             QWidget{
                 background: #282C34;
@@ -51,18 +48,14 @@ def run():
     app.setStyleSheet(style)
     app.setWindowIcon(QIcon("google-drive.png"))
 
-    # read cache.json if exists otherwise set timestamp to 7 days ago
-    if os.path.exists("cache.json"):
-        with open("cache.json", "r") as f:
-            data = json.load(f)
-    else:
-        data = {"timestamp": "", "local_directory": "", "drive_id": ""}
-        with open("cache.json", "w") as f:
-            json.dump(data, f)
+    # read cache.json if exists otherwise create it with an empty timestamp
+    data = load_cache()
 
-    drive_client = GoogleDriveClient()
+    # the client authenticates on the first sync, in the sync thread, so the window shows without waiting
+    drive_client = GoogleDriveClient(FOLDER_CACHE_FILE, download_journal_file=DOWNLOAD_JOURNAL_FILE,
+                                     index_directory=INDEX_DIRECTORY, metrics_file=METRICS_FILE,
+                                     checkpoint_file=CHECKPOINT_FILE)
     widgets = Widgets(app, drive_client, data)
-    drive_client.events_manager.set_gui_client(widgets)
     widgets.show()
     app.exec_()
 
@@ -1,12 +1,67 @@
 import datetime
-import json
+import html
 import os
 
 from PyQt5 import QtGui
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QThread
 from PyQt5.QtGui import QFont, QTextCursor, QIcon
 from PyQt5.QtWidgets import *
 
+from Settings import save_cache
+from SyncWorker import SyncWorker
+
+SYNC_MODES = {
+    "activity": "Drive Activity",
+    "changes": "Changes API",
+}
+
+events_colors = {
+    "create": "#DB8521",
+    "update": "#DB8521",
+    "download": "#DB8521",
+    "resume": "#DB8521",
+    "done": "#23DB45",
+    "dedupe": "#23DB45",
+    "sync_done": "#23DB45",
+    "move": "#23DBAE",
+    "rename": "#23DBAE",
+    "restore": "#23DBAE",
+    "restore_folder": "#23DBAE",
+    "delete": "#DB5023",
+    "delete_folder": "#DB5023",
+    "skip_type": "#fff",
+    "skip_unchanged": "#fff",
+    "skip_filter": "#fff",
+    "no_changes": "#fff",
+    "plan": "#fff",
+    "start": "#fff",
+    "upload": "#DB8521",
+    "upload_folder": "#DB8521",
+    "upload_move": "#23DBAE",
+    "upload_delete": "#DB5023",
+}
+
+# number of lines kept in the log, older lines are dropped
+LOG_LIMIT = 1000
+
+
+def render_event(event):
+    """
+    Render a sync event as HTML for the log.
+    :param event: SyncEvent object.
+    :return: HTML text.
+    """
+    text = html.escape(event.describe())
+    if event.name:
+        name = html.escape(event.name)
+        text = text.replace(name, f"<b>{name}</b>", 1)
+    color = events_colors.get(event.kind, "#fff")
+    if event.kind == "start":
+        return f"<h2 style='color:{color}'>{text}</h2>"
+    if event.kind in ("no_changes", "sync_done"):
+        return f"<br><h3 style='color:{color}'>{text}</h3>"
+    return f"<p style='color:{color}'>{text}</p>"
+
 
 class Widgets(QWidget):
     def __init__(self, app, drive_client, cache_data):
@@ -16,6 +71,12 @@ class Widgets(QWidget):
         self.last_timestamp = cache_data["timestamp"]
         self.local_directory = cache_data["local_directory"]
         self.drive_id = cache_data["drive_id"]
+        self.sync_mode = cache_data.get("sync_mode", "activity")
+        self.page_token = cache_data.get("page_token", "")
+        self.sync_thread = None
+        self.sync_worker = None
+        self.pending_cache_data = None
+        self.downloads_progress = {}
         self.init_ui()
 
         self.error_dialog = QMessageBox()
@@ -54,6 +115,20 @@ class Widgets(QWidget):
         self.t4.setText(self.drive_id)
         self.h_layout4.addWidget(self.t4)
 
+        self.h_layout5 = QHBoxLayout()
+
+        self.l5 = QLabel()
+        self.l5.setFont(QFont("Roboto", 15))
+        self.l5.setText("Sync Mode")
+        self.h_layout5.addWidget(self.l5)
+
+        self.c5 = QComboBox()
+        self.c5.setFont(QFont("Roboto", 15))
+        for mode, mode_name in SYNC_MODES.items():
+            self.c5.addItem(mode_name, mode)
+        self.c5.setCurrentIndex(max(self.c5.findData(self.sync_mode), 0))
+        self.h_layout5.addWidget(self.c5)
+
         self.h_layout2 = QHBoxLayout()
 
         self.btn = QPushButton("Sync")
@@ -62,16 +137,29 @@ class Widgets(QWidget):
         self.btn.setFont(QFont("Roboto", 15))
         self.h_layout2.addWidget(self.btn)
 
+        self.btn3 = QPushButton("Cancel")
+        self.btn3.clicked.connect(self.cancel_sync)
+        self.btn3.setFixedSize(100, 50)
+        self.btn3.setFont(QFont("Roboto", 15))
+        self.btn3.setEnabled(False)
+        self.h_layout2.addWidget(self.btn3)
+
         self.h_layout3 = QHBoxLayout()
 
         self.text_box = QTextBrowser()
         self.text_box.setFont(QFont("Roboto", 15))
+        self.text_box.document().setMaximumBlockCount(LOG_LIMIT)
         self.h_layout3.addWidget(self.text_box)
 
+        self.progress_label = QLabel()
+        self.progress_label.setFont(QFont("Roboto", 12))
+
         self.v_layout.addLayout(self.h_layout1)
         self.v_layout.addLayout(self.h_layout4)
+        self.v_layout.addLayout(self.h_layout5)
         self.v_layout.addLayout(self.h_layout2)
         self.v_layout.addLayout(self.h_layout3)
+        self.v_layout.addWidget(self.progress_label)
         self.v_layout.setAlignment(Qt.AlignTop)
 
         self.setLayout(self.v_layout)
@@ -96,9 +184,25 @@ class Widgets(QWidget):
         qr.moveCenter(cp)
         self.move(qr.topLeft())
 
-    def notify(self, event, text):
-        self.text_box.append(text)
-        self.app.processEvents()
+    def notify(self, events):
+        """
+        Show a batch of sync events, download progress goes to the status line instead of the log.
+        :param events: SyncEvent objects.
+        :return: None.
+        """
+        lines = []
+        for event in events:
+            if event.kind == "progress":
+                self.downloads_progress[event.name] = event.progress
+                continue
+            if event.kind == "done":
+                self.downloads_progress.pop(event.name, None)
+            lines.append(render_event(event))
+
+        if lines:
+            self.text_box.append("".join(lines))
+        self.progress_label.setText("   ".join(f"{name} {progress}%"
+                                                for name, progress in self.downloads_progress.items()))
 
     def sync(self):
         directory = self.t1.text()
@@ -108,14 +212,67 @@ class Widgets(QWidget):
             self.error_dialog.show()
         else:
             current_timestamp = datetime.datetime.utcnow().isoformat() + 'Z'
-            new_cache_data = {"timestamp": current_timestamp, "local_directory": directory, "drive_id": drive_id}
+            sync_mode = self.c5.currentData()
+            # the page token belongs to one Drive folder
+            if drive_id != self.drive_id:
+                self.page_token = ""
 
             self.text_box.clear()
             self.text_box.moveCursor(QTextCursor.Start)
 
             self.drive_client.build_drive_client(directory, drive_id, self.last_timestamp)
+            self.pending_cache_data = {"timestamp": current_timestamp, "local_directory": directory,
+                                       "drive_id": drive_id, "sync_mode": sync_mode}
+
+            # the sync runs on its own thread and reports back through queued signals
+            self.sync_thread = QThread()
+            self.sync_worker = SyncWorker(self.drive_client, sync_mode, self.page_token, current_timestamp)
+            self.sync_worker.moveToThread(self.sync_thread)
+            self.sync_thread.started.connect(self.sync_worker.run)
+            self.sync_worker.events.connect(self.notify)
+            self.sync_worker.finished.connect(self.sync_finished)
+            self.sync_worker.cancelled.connect(self.sync_cancelled)
+            self.sync_worker.failed.connect(self.sync_failed)
+            self.sync_worker.stopped.connect(self.sync_thread.quit)
+            self.sync_thread.finished.connect(self.sync_stopped)
+
+            self.btn.setEnabled(False)
+            self.btn3.setEnabled(True)
+            self.sync_thread.start()
+
+    def cancel_sync(self):
+        if self.sync_worker is not None:
+            self.btn3.setEnabled(False)
+            self.sync_worker.cancel()
+
+    def sync_finished(self, page_token):
+        new_cache_data = self.pending_cache_data
+        new_cache_data["page_token"] = page_token
+        self.last_timestamp = new_cache_data["timestamp"]
+        self.drive_id = new_cache_data["drive_id"]
+        self.sync_mode = new_cache_data["sync_mode"]
+        self.page_token = page_token
+
+        save_cache(new_cache_data)
+
+    def sync_cancelled(self):
+        self.text_box.append("<html><br><h3 style='color:#DB5023'>Syncing cancelled.</h3></html>")
+
+    def sync_failed(self, error):
+        self.text_box.append(
+            f"<html><br><h3 style='color:#DB5023'>Syncing failed: {html.escape(str(error))}</h3></html>")
 
-            self.drive_client.get_changes_and_download(current_timestamp)
+    def sync_stopped(self):
+        self.downloads_progress = {}
+        self.progress_label.setText("")
+        self.sync_worker = None
+        self.sync_thread = None
+        self.btn.setEnabled(True)
+        self.btn3.setEnabled(False)
 
-            with open("cache.json", "w") as cache:
-                json.dump(new_cache_data, cache)
+    def closeEvent(self, event):
+        if self.sync_thread is not None:
+            self.sync_worker.cancel()
+            self.sync_thread.quit()
+            self.sync_thread.wait()
+        super(Widgets, self).closeEvent(event)
@@ -0,0 +1,205 @@
+import datetime
+import heapq
+import itertools
+import threading
+import time
+
+# files edited this recently are scheduled as if they were RECENT_BOOST times smaller
+RECENT_SECONDS = 24 * 3600
+RECENT_BOOST = 16
+
+# under a rate cap, a chunk carries at most this many seconds of transfer, so preemption stays responsive
+CHUNK_SECONDS = 2
+MIN_CHUNK_SIZE = 256 * 1024
+
+# bandwidth left unused is saved up to this many seconds of the rate, for the next chunks
+BURST_SECONDS = 1
+
+RATE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_rate(text):
+    """
+    Parse a rate in bytes per second, e.g. "500K" or "2M".
+    :param text: rate, with an optional K, M or G suffix.
+    :return: bytes per second, None for "unlimited".
+    """
+    text = str(text).strip().upper()
+    if text in ("", "UNLIMITED"):
+        return None
+    unit = RATE_UNITS.get(text[-1])
+    rate = int(float(text[:-1] if unit else text) * (unit or 1))
+    if rate <= 0:
+        raise ValueError(f"rate must be positive: {text}")
+    return rate
+
+
+def parse_window(text):
+    """
+    Parse a time-of-day rate window, e.g. "09:00-18:00=1M", windows may span midnight, e.g. "22:00-07:00=unlimited".
+    :param text: window as start-end=rate in local time.
+    :return: tuple of the start minute, end minute and bytes per second.
+    """
+    span, separator, rate = text.partition("=")
+    start, _, end = span.partition("-")
+    if not separator or not end:
+        raise ValueError(f"rate windows look like 09:00-18:00=1M: {text}")
+
+    def minute(clock):
+        hours, _, minutes = clock.strip().partition(":")
+        return int(hours) * 60 + int(minutes or 0)
+
+    return minute(start), minute(end), parse_rate(rate)
+
+
+def divide_rates(rate, windows, parts):
+    """
+    Split the caps between processes downloading at the same time, e.g. the roots of MultiRootSync.
+    :param rate: bytes per second outside the windows, None for no cap.
+    :param windows: rate windows, see parse_window.
+    :param parts: number of processes.
+    :return: tuple of the rate and the parsed windows of one process.
+    """
+    def divide(total):
+        return None if total is None else max(1, total // parts)
+
+    windows = [parse_window(window) if isinstance(window, str) else window for window in windows or []]
+    return divide(rate), [(start, end, divide(window_rate)) for start, end, window_rate in windows]
+
+
+def parse_modified_time(modified_time):
+    """
+    :param modified_time: RFC 3339 modifiedTime of Drive, e.g. "2023-05-01T10:00:00.000Z".
+    :return: seconds since the epoch, or None.
+    """
+    if not modified_time:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(modified_time.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+class Transfer:
+    def __init__(self, size=None, modified_time=None, progress=0):
+        """
+        A download in the bandwidth scheduler, its priority is its remaining bytes, so the smallest job goes first.
+        :param size: size in bytes, None for exports whose size is unknown until they are made.
+        :param modified_time: Drive modifiedTime, recent edits are what people wait on.
+        :param progress: bytes already on disk, e.g. of a resumed download.
+        """
+        self.size = int(size) if size is not None else None
+        modified = parse_modified_time(modified_time)
+        self.recent = modified is not None and time.time() - modified < RECENT_SECONDS
+        self.progress = progress
+
+    @property
+    def priority(self):
+        remaining = max(0, self.size - self.progress) if self.size is not None else 0
+        return remaining / RECENT_BOOST if self.recent else remaining
+
+
+class BandwidthScheduler:
+    def __init__(self, max_transfers=4, rate=None, windows=None):
+        """
+        Grant transfers the right to fetch their next chunk, one chunk at a time.
+        The waiting transfer with the fewest remaining bytes goes first, a large download gives its slot up at every
+        chunk boundary and gets it back once the smaller files are done.
+        Every granted chunk is charged to a token bucket of the current rate, so all the transfers together stay
+        under it.
+        :param max_transfers: chunks fetched at once.
+        :param rate: bytes per second outside the windows, None for no cap.
+        :param windows: time-of-day rate windows, e.g. ["09:00-18:00=1M"] or already parsed, see parse_window.
+        """
+        self.max_transfers = max_transfers
+        self.rate = rate
+        self.windows = [parse_window(window) if isinstance(window, str) else tuple(window)
+                        for window in windows or []]
+        self.active = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.condition = threading.Condition()
+
+    def current_rate(self):
+        """
+        :return: bytes per second allowed now, None for no cap.
+        """
+        if self.windows:
+            now = datetime.datetime.now()
+            minute = now.hour * 60 + now.minute
+            for start, end, rate in self.windows:
+                if start <= minute < end or (end < start and (minute >= start or minute < end)):
+                    return rate
+        return self.rate
+
+    def chunk_size(self, chunk_size):
+        """
+        Shrink the chunks under a rate cap, a chunk cannot be preempted while it is transferred.
+        :param chunk_size: configured chunk size in bytes.
+        :return: chunk size in bytes to request next.
+        """
+        rate = self.current_rate()
+        if rate is None:
+            return chunk_size
+        return max(MIN_CHUNK_SIZE, min(chunk_size, rate * CHUNK_SECONDS // MIN_CHUNK_SIZE * MIN_CHUNK_SIZE))
+
+    def acquire(self, transfer, check_cancelled=None):
+        """
+        Wait until the transfer may fetch its next chunk.
+        :param transfer: Transfer.
+        :param check_cancelled: function called while waiting, raising to stop waiting.
+        :return: seconds waited.
+        """
+        start = time.monotonic()
+        entry = [transfer.priority, next(self.sequence), transfer]
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            try:
+                while True:
+                    delay = 0.5
+                    if self.waiting[0] is entry and self.active < self.max_transfers:
+                        delay = self.refill()
+                        if delay == 0:
+                            heapq.heappop(self.waiting)
+                            self.active += 1
+                            # the next transfer in line may also fit
+                            self.condition.notify_all()
+                            return time.monotonic() - start
+                    self.condition.wait(min(delay, 0.5))
+                    if check_cancelled is not None:
+                        check_cancelled()
+            except BaseException:
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+                raise
+
+    def release(self, transferred):
+        """
+        End the chunk of a transfer and charge its bytes to the rate cap.
+        :param transferred: bytes received in the chunk.
+        :return: None.
+        """
+        with self.condition:
+            self.active -= 1
+            if self.current_rate() is not None:
+                self.refill()
+                self.tokens -= transferred
+            self.condition.notify_all()
+
+    def refill(self):
+        """
+        Add the tokens earned since the last refill, the bucket goes negative when a chunk was larger than the
+        tokens left and the next chunk waits until the debt is paid.
+        :return: seconds until the next chunk may start, 0 if it may start now.
+        """
+        now = time.monotonic()
+        rate = self.current_rate()
+        if rate is None:
+            self.tokens, self.updated = 0.0, now
+            return 0
+        self.tokens = min(rate * BURST_SECONDS, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        return 0 if self.tokens >= 0 else -self.tokens / rate
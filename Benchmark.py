@@ -0,0 +1,397 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from BandwidthScheduler import parse_rate
+from Drive import ACTIVITY_PAGE_SIZE, CHANGES_PAGE_SIZE, EXTENSIONS, PREFETCH_PAGES, GoogleDriveClient
+from FakeDrive import FOLDER_TYPE, FakeDrive
+
+
+def deep_tree(fake, args):
+    """New files spread over a deep folder tree."""
+    return lambda: fake.build_tree(depth=args.depth, folders_per_level=1, files_per_folder=args.files,
+                                   file_size=args.size)
+
+
+def burst_edits(fake, args):
+    """The same few files edited many times since the last sync."""
+    _, files = fake.build_tree(depth=2, folders_per_level=2, files_per_folder=2, file_size=args.size)
+
+    def mutate():
+        for _ in range(args.edits):
+            for file_id in files:
+                fake.edit(file_id)
+
+    return mutate
+
+
+def mass_moves(fake, args):
+    """Many files moved from one folder to another."""
+    source = fake.create_folder("source", fake.root_id)
+    destination = fake.create_folder("destination", fake.root_id)
+    files = [fake.create_file(f"file {index}.bin", source, args.size) for index in range(args.files * 10)]
+
+    def mutate():
+        for file_id in files:
+            fake.move(file_id, destination)
+
+    return mutate
+
+
+def large_files(fake, args):
+    """A few large files."""
+    def mutate():
+        for index in range(3):
+            fake.create_file(f"large {index}.bin", fake.root_id, args.large_size)
+
+    return mutate
+
+
+def first_sync(fake, args):
+    """A first sync of a folder with a long history: edited files and files created then deleted."""
+    def mutate():
+        _, files = fake.build_tree(depth=3, folders_per_level=2, files_per_folder=args.files, file_size=args.size)
+        for index in range(args.edits):
+            for file_id in files[:args.files]:
+                fake.edit(file_id)
+            fake.delete(fake.create_file(f"transient {index}.bin", fake.root_id, args.size))
+
+    return mutate
+
+
+def duplicates(fake, args):
+    """A first sync of a folder holding many copies of the same attachments."""
+    def mutate():
+        originals = [fake.create_file(f"attachment {index}.bin", fake.root_id, args.size) for index in range(3)]
+        for folder_index in range(args.files):
+            folder_id = fake.create_folder(f"thread {folder_index}", fake.root_id)
+            for file_id in originals:
+                fake.copy(file_id, fake.files[file_id]["name"], folder_id)
+
+    return mutate
+
+
+def mixed_sizes(fake, args):
+    """Many small documents created along with a few large files."""
+    def mutate():
+        for index in range(2):
+            fake.create_file(f"large {index}.bin", fake.root_id, args.large_size)
+        for index in range(args.files * 10):
+            fake.create_file(f"document {index}.bin", fake.root_id, args.size)
+
+    return mutate
+
+
+def rename_swap(fake, args):
+    """Two files and two folders swapping their names through a temporary name."""
+    files = [fake.create_file(name, fake.root_id, args.size) for name in ("a.bin", "c.bin")]
+    folders = [fake.create_folder(name, fake.root_id) for name in ("A", "C")]
+    for folder_id in folders:
+        fake.create_file("inside.bin", folder_id, args.size)
+
+    def mutate():
+        for first, second, (first_name, second_name) in ((*files, ("a.bin", "c.bin")), (*folders, ("A", "C"))):
+            fake.rename(first, "tmp")
+            fake.rename(second, first_name)
+            fake.rename(first, second_name)
+
+    return mutate
+
+
+def same_name_rename(fake, args):
+    """A folder renamed to the name of a sibling folder, Drive allows both."""
+    drafts = fake.create_folder("Drafts", fake.root_id)
+    reports = fake.create_folder("Reports", fake.root_id)
+    fake.create_file("d.bin", drafts, args.size)
+    fake.create_file("r.bin", reports, args.size)
+    return lambda: fake.rename(drafts, "Reports")
+
+
+def edit_rename(fake, args):
+    """Files edited then renamed since the last sync."""
+    files = [fake.create_file(f"file {index}.bin", fake.root_id, args.size) for index in range(args.files)]
+
+    def mutate():
+        for index, file_id in enumerate(files):
+            fake.edit(file_id)
+            fake.rename(file_id, f"renamed {index}.bin")
+
+    return mutate
+
+
+def edit_rename_parent(fake, args):
+    """Files edited then renamed, then their folder renamed, since the last sync."""
+    folder_id = fake.create_folder("src", fake.root_id)
+    files = [fake.create_file(f"file {index}.bin", folder_id, args.size) for index in range(args.files * 6)]
+
+    def mutate():
+        for index, file_id in enumerate(files):
+            fake.edit(file_id)
+            fake.rename(file_id, f"renamed {index}.bin")
+        fake.rename(folder_id, "src2")
+
+    return mutate
+
+
+def google_docs(fake, args):
+    """Docs, Sheets and Slides, exported with an extension, edited, renamed, moved and trashed."""
+    folder_id = fake.create_folder("documents", fake.root_id)
+    archive_id = fake.create_folder("archive", fake.root_id)
+    documents = [fake.create_file(f"document {index}", folder_id, mime_type=mime_type)
+                 for index in range(args.files) for mime_type in EXTENSIONS]
+
+    def mutate():
+        for index, file_id in enumerate(documents):
+            fake.edit(file_id)
+            if index % 4 == 0:
+                fake.rename(file_id, f"renamed {index}")
+            elif index % 4 == 1:
+                fake.move(file_id, archive_id)
+            elif index % 4 == 2:
+                fake.delete(file_id)
+        fake.rename(folder_id, "documents 2")
+
+    return mutate
+
+
+def move_trash_parent(fake, args):
+    """A folder moved out of its parent, then the parent trashed."""
+    parent = fake.create_folder("A", fake.root_id)
+    moved = fake.create_folder("B", parent)
+    destination = fake.create_folder("C", fake.root_id)
+    for index in range(args.files):
+        fake.create_file(f"file {index}.bin", moved, args.size)
+    fake.create_file("trashed.bin", parent, args.size)
+
+    def mutate():
+        fake.move(moved, destination)
+        fake.delete(parent)
+
+    return mutate
+
+
+SCENARIOS = {
+    "deep_tree": deep_tree,
+    "burst_edits": burst_edits,
+    "mass_moves": mass_moves,
+    "large_files": large_files,
+    "first_sync": first_sync,
+    "duplicates": duplicates,
+    "mixed_sizes": mixed_sizes,
+    "rename_swap": rename_swap,
+    "same_name_rename": same_name_rename,
+    "edit_rename": edit_rename,
+    "edit_rename_parent": edit_rename_parent,
+    "google_docs": google_docs,
+    "move_trash_parent": move_trash_parent,
+}
+
+# scenarios measuring the first sync of a folder, without a previous sync
+FIRST_SYNC_SCENARIOS = {"first_sync", "duplicates"}
+
+# scenarios run without latency, their downloads finish before the sync replays the next activities
+NO_LATENCY_SCENARIOS = {"edit_rename_parent", "google_docs"}
+
+
+def check_mirror(fake, client, local_directory):
+    """
+    Compare the local directory with the fake Drive after a sync.
+    Every file is indexed at its Drive path with its Drive content, and nothing else is on disk.
+    Siblings with the same name cannot both have their Drive path locally, they only need their own local copy.
+    :param fake: FakeDrive.
+    :param client: GoogleDriveClient that synced the fake Drive.
+    :param local_directory: synced local directory.
+    :return: list of problem descriptions.
+    """
+    problems = []
+    allowed = {""}
+    indexed = {}
+
+    def walk(folder_id, relative_path, unique):
+        children = [metadata for metadata in fake.files.values()
+                    if folder_id in metadata["parents"] and not metadata["trashed"]]
+        names = Counter(metadata["name"] + EXTENSIONS.get(metadata["mimeType"], "") for metadata in children)
+        for metadata in children:
+            if client.sync_filter.excludes_file(metadata["name"], metadata["mimeType"], metadata.get("size")):
+                continue
+            name = metadata["name"] + EXTENSIONS.get(metadata["mimeType"], "")
+            path = os.path.join(relative_path, name) if relative_path else name
+            child_unique = unique and names[name] == 1
+            entry = client.index.get(metadata["id"])
+            local_path = entry["local_path"] if entry is not None else None
+            if local_path is not None and os.path.exists(local_path):
+                local_path = os.path.relpath(local_path, local_directory)
+                allowed.add(local_path)
+                if local_path in indexed:
+                    problems.append(f"{path}: indexed at {local_path} like {indexed[local_path]}")
+                indexed[local_path] = path
+            elif metadata["mimeType"] != FOLDER_TYPE or not child_unique:
+                problems.append(f"{path}: missing")
+                continue
+            else:
+                local_path = path
+
+            if child_unique and local_path != path:
+                problems.append(f"{path}: synced to {local_path}")
+            if metadata["mimeType"] == FOLDER_TYPE:
+                allowed.add(local_path)
+                walk(metadata["id"], path, child_unique)
+            elif metadata["id"] in fake.contents:
+                with open(os.path.join(local_directory, local_path), "rb") as f:
+                    if f.read() != fake.contents[metadata["id"]]:
+                        problems.append(f"{path}: content differs")
+
+    walk(fake.root_id, "", True)
+    for directory, folders, files in os.walk(local_directory):
+        for name in folders + files:
+            path = os.path.relpath(os.path.join(directory, name), local_directory)
+            if path not in allowed:
+                problems.append(f"{path}: not on Drive")
+    return problems
+
+
+def run_scenario(name, mode, args):
+    """
+    Mirror the initial state of a scenario, apply its changes on the fake Drive and time the sync of those changes.
+    :param name: scenario name.
+    :param mode: "activity" or "changes".
+    :param args: command line arguments.
+    :return: result of the measured sync.
+    """
+    fake = FakeDrive()
+    mutate = SCENARIOS[name](fake, args)
+    output = sys.stdout if args.verbose else io.StringIO()
+
+    with tempfile.TemporaryDirectory() as local_directory, contextlib.redirect_stdout(output):
+        client = GoogleDriveClient(download_workers=args.workers, chunk_size=args.chunk_size,
+                                   drive_service=fake.drive_service, activity_service=fake.activity_service,
+                                   activity_page_size=args.activity_page_size,
+                                   changes_page_size=args.changes_page_size, prefetch_pages=args.prefetch,
+                                   max_rate=args.max_rate)
+        client.requests.base_delay = args.retry_delay
+        baseline_timestamp, page_token = "", ""
+        if name not in FIRST_SYNC_SCENARIOS:
+            client.build_drive_client(local_directory, fake.root_id, "")
+            baseline_timestamp = fake.tick()
+            client.get_changes_and_download(baseline_timestamp)
+            page_token = fake.drive_service.changes().getStartPageToken().execute()['startPageToken']
+
+        mutate()
+        fake.latency = 0 if name in NO_LATENCY_SCENARIOS else args.latency
+        fake.error_rate = args.error_rate
+        fake.reset_counters()
+        call_timestamp = fake.tick()
+        client.build_drive_client(local_directory, fake.root_id, baseline_timestamp)
+
+        start = time.perf_counter()
+        if mode == "changes":
+            client.sync_changes(page_token, call_timestamp)
+        else:
+            client.get_changes_and_download(call_timestamp)
+        wall_time = time.perf_counter() - start
+        client.downloads.shutdown()
+        problems = check_mirror(fake, client, local_directory)
+
+    return {
+        "scenario": name,
+        "mode": mode,
+        "wall_time": round(wall_time, 3),
+        "api_calls": sum(fake.calls.values()),
+        "calls": dict(fake.calls),
+        "bytes": fake.bytes_served,
+        "errors": fake.errors_injected,
+        "retries": client.metrics.last_report["counters"].get("retries", 0),
+        "changes": client.changes_applied,
+        "phases": {name: timing["total"] for name, timing in client.metrics.last_report["timings"].items()},
+        "mirror_problems": problems,
+    }
+
+
+def check_regressions(results, baseline_file, tolerance):
+    """
+    Compare the API calls and bytes with a previous report, wall times are too noisy to compare.
+    :return: list of regression descriptions.
+    """
+    with open(baseline_file, "r") as f:
+        baseline = {(result["scenario"], result["mode"]): result for result in json.load(f)}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["scenario"], result["mode"]))
+        if previous is None:
+            continue
+        for metric in ("api_calls", "bytes"):
+            if result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{result['scenario']} ({result['mode']}): {metric} went from"
+                                   f" {previous[metric]} to {result[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline sync benchmarks on an in-memory fake Drive.")
+    parser.add_argument("scenarios", nargs="*", help="scenarios to run, all by default: " + ", ".join(SCENARIOS))
+    parser.add_argument("--mode", choices=["activity", "changes", "both"], default="both")
+    parser.add_argument("--depth", type=int, default=8, help="depth of the deep tree")
+    parser.add_argument("--files", type=int, default=5, help="files per folder")
+    parser.add_argument("--size", type=int, default=64 * 1024, help="size in bytes of the regular files")
+    parser.add_argument("--large-size", type=int, default=64 * 1024 * 1024, help="size in bytes of the large files")
+    parser.add_argument("--edits", type=int, default=20, help="edits per file in burst_edits")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per API call or media chunk")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of the calls failing with a quota error")
+    parser.add_argument("--retry-delay", type=float, default=0.01, help="delay in seconds before the first retry")
+    parser.add_argument("--workers", type=int, default=4, help="number of concurrent downloads")
+    parser.add_argument("--chunk-size", type=int, default=10 * 1024 * 1024, help="download chunk size in bytes")
+    parser.add_argument("--activity-page-size", type=int, default=ACTIVITY_PAGE_SIZE, help="activities per page")
+    parser.add_argument("--changes-page-size", type=int, default=CHANGES_PAGE_SIZE, help="changes per page")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH_PAGES, help="pages fetched ahead")
+    parser.add_argument("--max-rate", type=parse_rate, help="bytes per second of all the downloads, e.g. 2M")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="fail if API calls or bytes grew compared to this results file")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed growth compared to the baseline")
+    parser.add_argument("--phases", action="store_true", help="show the time spent in each phase")
+    parser.add_argument("--verbose", action="store_true", help="show the sync output")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+
+    modes = ["activity", "changes"] if args.mode == "both" else [args.mode]
+    results = []
+    print(f"{'scenario':<19}{'mode':<10}{'wall time':>10}{'API calls':>11}{'bytes':>14}{'changes':>9}{'retries':>9}"
+          f"{'mirror':>8}")
+    for name in args.scenarios or SCENARIOS:
+        for mode in modes:
+            result = run_scenario(name, mode, args)
+            results.append(result)
+            print(f"{name:<19}{mode:<10}{result['wall_time']:>9.3f}s{result['api_calls']:>11}"
+                  f"{result['bytes']:>14}{result['changes']:>9}{result['retries']:>9}"
+                  f"{'ok' if not result['mirror_problems'] else 'FAIL':>8}")
+            for problem in result["mirror_problems"]:
+                print(f"    mirror: {problem}")
+            if args.phases:
+                for phase, total in sorted(result["phases"].items(), key=lambda item: -item[1]):
+                    print(f"    {phase:<36}{total:>9.3f}s")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = any(result["mirror_problems"] for result in results)
+    if args.baseline:
+        regressions = check_regressions(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        failed = failed or bool(regressions)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
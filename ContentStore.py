@@ -0,0 +1,71 @@
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Linux ioctl sharing the extents of a file with another file, on Btrfs, XFS and other copy-on-write filesystems
+FICLONE = 0x40049409
+
+
+class ContentStore:
+    def __init__(self, hardlinks=False):
+        """
+        Local copies of identical Drive files, keyed by their MD5 checksum.
+        The sync index is the checksum to path store, this tracks the downloads in flight so identical files
+        downloaded in the same sync wait for the first one instead of downloading the content again.
+        :param hardlinks: allow hard links when a reflink is not possible. Hard linked copies share their content,
+        editing one locally edits the others, so they are opt-in.
+        """
+        self.hardlinks = hardlinks
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def claim(self, md5_checksum):
+        """
+        Claim the download of some content.
+        :param md5_checksum: MD5 checksum of the content.
+        :return: None if the caller downloads it and must release it, otherwise an event set when it is downloaded.
+        """
+        with self.lock:
+            download = self.in_flight.get(md5_checksum)
+            if download is None:
+                self.in_flight[md5_checksum] = threading.Event()
+            return download
+
+    def release(self, md5_checksum):
+        """
+        Release a claimed content, its local copy is in the index or the download failed.
+        :param md5_checksum: MD5 checksum of the content.
+        :return: None.
+        """
+        with self.lock:
+            download = self.in_flight.pop(md5_checksum, None)
+        if download is not None:
+            download.set()
+
+    def clone(self, source, target):
+        """
+        Make a copy of a local file without a network transfer: a reflink, a hard link if allowed, or a copy.
+        :param source: existing local file.
+        :param target: new file, it must not exist.
+        :return: method used, "reflink", "hardlink" or "copy".
+        """
+        if fcntl is not None:
+            try:
+                with open(source, 'rb') as source_file, open(target, 'wb') as target_file:
+                    fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+                return "reflink"
+            except OSError:
+                os.remove(target)
+        if self.hardlinks:
+            try:
+                os.link(source, target)
+                return "hardlink"
+            except OSError:
+                pass
+        shutil.copyfile(source, target)
+        return "copy"
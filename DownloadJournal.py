@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+
+
+class DownloadJournal:
+    def __init__(self, journal_file=None):
+        """
+        Record of partial downloads, so an interrupted transfer can resume where it stopped.
+        :param journal_file: optional JSON file to keep the records between runs.
+        """
+        self.journal_file = journal_file
+        self.records = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Load the records from the journal file if it exists.
+        :return: None.
+        """
+        if self.journal_file is None or not os.path.exists(self.journal_file):
+            return
+        try:
+            with open(self.journal_file, "r") as f:
+                self.records = json.load(f)
+        except (OSError, ValueError) as error:
+            print('Could not read the download journal: {}'.format(error))
+
+    def get(self, file_id):
+        """
+        Get the partial download of a file.
+        :param file_id: file ID.
+        :return: record with temp_path, offset, md5Checksum and modifiedTime, or None.
+        """
+        with self.lock:
+            return self.records.get(file_id)
+
+    def record(self, file_id, temp_path, offset, md5_checksum, modified_time):
+        """
+        Record the progress of a download.
+        :param file_id: file ID.
+        :param temp_path: temporary file the download is written to.
+        :param offset: number of bytes written to the temporary file.
+        :param md5_checksum: MD5 checksum of the remote revision.
+        :param modified_time: modified time of the remote revision.
+        :return: None.
+        """
+        with self.lock:
+            self.records[file_id] = {
+                "temp_path": temp_path,
+                "offset": offset,
+                "md5Checksum": md5_checksum,
+                "modifiedTime": modified_time,
+            }
+            self.save()
+
+    def remove(self, file_id):
+        """
+        Forget the partial download of a file.
+        :param file_id: file ID.
+        :return: None.
+        """
+        with self.lock:
+            if self.records.pop(file_id, None) is not None:
+                self.save()
+
+    def save(self):
+        if self.journal_file is None:
+            return
+        temp_file = self.journal_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.records, f)
+        os.replace(temp_file, self.journal_file)
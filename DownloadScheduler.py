@@ -0,0 +1,117 @@
+import heapq
+import itertools
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+
+class DownloadScheduler:
+    def __init__(self, max_workers=4, on_wait=None, silent_errors=()):
+        """
+        Run downloads on a bounded thread pool with per-path ordering barriers.
+        Queued downloads start in priority order, lowest first, then in the order they were scheduled.
+        :param max_workers: number of concurrent downloads.
+        :param on_wait: callback called periodically on the calling thread while it waits for downloads.
+        :param silent_errors: exception types of downloads that are not printed, e.g. a cancellation.
+        """
+        self.max_workers = max_workers
+        self.on_wait = on_wait
+        self.silent_errors = silent_errors
+        self.executor = None
+        self.pending = {}
+        self.queue = []
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+
+    def submit(self, path, download, *args, priority=0):
+        """
+        Schedule a download. A pending download to the same path is waited for first.
+        :param path: local path the download writes to, used as its ordering key.
+        :param download: function doing the transfer.
+        :param args: arguments of the function.
+        :param priority: queued downloads with a lower priority start first, e.g. their size.
+        :return: future of the download.
+        """
+        self.wait_for(path)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="download")
+
+        future = Future()
+        with self.lock:
+            heapq.heappush(self.queue, (priority, next(self.sequence), future, download, args))
+            self.pending[path] = future
+        future.add_done_callback(lambda done_future: self._done(path, done_future))
+        # every worker task runs the queued download with the lowest priority at the time it starts
+        self.executor.submit(self._run_next)
+        self._notify_wait()
+        return future
+
+    def is_pending(self, path):
+        """
+        Check if a download to a path is scheduled or running.
+        :param path: local path.
+        :return: True if pending, False otherwise.
+        """
+        with self.lock:
+            return path in self.pending
+
+    def wait_for(self, path):
+        """
+        Wait for the pending downloads to a path or anywhere under it.
+        Call it before renaming, moving or deleting the path.
+        :param path: local path of a file or folder.
+        :return: None.
+        """
+        prefix = os.path.join(path, "")
+        with self.lock:
+            futures = [future for pending_path, future in self.pending.items()
+                       if pending_path == path or pending_path.startswith(prefix)]
+        self._wait(futures)
+
+    def wait_all(self):
+        """
+        Wait for every pending download.
+        :return: None.
+        """
+        with self.lock:
+            futures = list(self.pending.values())
+        self._wait(futures)
+
+    def shutdown(self):
+        """
+        Wait for every pending download and stop the worker threads.
+        :return: None.
+        """
+        self.wait_all()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def _run_next(self):
+        with self.lock:
+            _, _, future, download, args = heapq.heappop(self.queue)
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = download(*args)
+        except BaseException as error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _wait(self, futures):
+        not_done = futures
+        while not_done:
+            _, not_done = wait(not_done, timeout=0.1)
+            self._notify_wait()
+
+    def _notify_wait(self):
+        if self.on_wait is not None:
+            self.on_wait()
+
+    def _done(self, path, future):
+        with self.lock:
+            if self.pending.get(path) is future:
+                del self.pending[path]
+        if future.exception() is not None and not isinstance(future.exception(), self.silent_errors):
+            print('An error occurred: {}'.format(future.exception()))
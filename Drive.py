@@ -1,30 +1,29 @@
 import datetime
-import io
+import hashlib
+import mmap
 import os
-import re
 import shutil
+import tempfile
+import threading
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseDownload
 
+from ContentStore import ContentStore
+from DownloadJournal import DownloadJournal
+from BandwidthScheduler import BandwidthScheduler, Transfer
+from DownloadScheduler import DownloadScheduler
 from EventsManager import EventsManager
+from FolderCache import FolderCache
+from Metrics import Metrics, sync_run, timed
+from PagePrefetcher import PagePrefetcher
+from RequestExecutor import RequestExecutor, is_retriable, is_throttled
+from SyncCheckpoint import FAILED, PENDING, SyncCheckpoint
+from SyncFilter import SyncFilter
+from SyncIndex import SyncIndex
+from SyncPlanner import SyncPlanner
 
 FOLDER_TYPE = "application/vnd.google-apps.folder"
 
-SKIP = [
-    "application/vnd.google-apps.audio",
-    "application/vnd.google-apps.video",
-]
-
-SKIP_REGEX = [
-    "video/*",
-    "audio/*",
-]
-
 MIMETYPES = {
     # Drive Document files as MS dox
     'application/vnd.google-apps.document': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
@@ -41,26 +40,99 @@ EXTENSIONS = {
     'application/vnd.google-apps.presentation': '.pptx'
 }
 
+FILE_FIELDS = ("id, name, mimeType, webViewLink, parents, shortcutDetails, trashed, md5Checksum, modifiedTime, size,"
+               " headRevisionId, version")
+
+# Downloads are streamed to disk one chunk at a time, so this bounds the memory used per transfer.
+CHUNK_SIZE = 10 * 1024 * 1024
+
+# download threads beyond the transfer slots, so small files can wait for a slot a large download gives up
+PREEMPTION_WORKERS = 2
+
+# default activities per page, the Drive Activity sync is checkpointed after applying each page worth of changes
+ACTIVITY_PAGE_SIZE = 200
+
+# default changes per page, at most 1000
+CHANGES_PAGE_SIZE = 1000
+
+# pages fetched ahead of the page being processed
+PREFETCH_PAGES = 1
+
+# files.list page size, and number of folders listed by one files.list query of the first sync
+LIST_PAGE_SIZE = 1000
+LIST_FOLDERS = 50
+
+# Google APIs accept at most 100 calls in one batch HTTP request.
+BATCH_SIZE = 100
+
 SCOPES = ['https://www.googleapis.com/auth/drive', 'https://www.googleapis.com/auth/drive.activity.readonly']
 
-events_colors = {
-    "create": "#DB8521",
-    "update": "#DB8521",
-    "download": "#DB8521",
-    "done": "#23DB45",
-    "move": "#23DBAE",
-    "rename": "#23DBAE",
-    "restore": "#23DBAE",
-    "delete": "#DB5023",
-    "skip": "#fff",
-    "start": "#fff",
-}
+
+class SyncCancelled(Exception):
+    """Raised inside a sync after GoogleDriveClient.cancel was called."""
 
 
 class GoogleDriveClient:
-    def __init__(self):
-        self.drive_service, self.activity_service = self.authenticate()
+    def __init__(self, folder_cache_file=None, download_workers=4, chunk_size=CHUNK_SIZE, download_journal_file=None,
+                 index_directory=None, drive_service=None, activity_service=None, metrics_file=None,
+                 prometheus_file=None, checkpoint_file=None, credentials=None, filters=None, dedupe_hardlinks=False,
+                 activity_page_size=ACTIVITY_PAGE_SIZE, changes_page_size=CHANGES_PAGE_SIZE,
+                 prefetch_pages=PREFETCH_PAGES, max_rate=None, rate_windows=None):
+        """
+        Build the Google Drive client.
+        :param folder_cache_file: optional file to keep the folder ancestry cache between runs.
+        :param download_workers: number of concurrent downloads.
+        :param chunk_size: size in bytes of each downloaded chunk.
+        :param download_journal_file: optional file recording partial downloads, so they resume on the next run.
+        :param index_directory: optional directory keeping one sync index per Drive folder, in memory otherwise.
+        :param drive_service: Drive v3 service to use instead of authenticating, e.g. an offline fake.
+        :param activity_service: Drive Activity v2 service to use with drive_service.
+        :param metrics_file: optional JSON file the timings and counters of each sync are written to.
+        :param prometheus_file: optional file the same metrics are written to in the Prometheus text format.
+        :param checkpoint_file: optional file keeping the progress of the running sync, so it resumes after a crash.
+        :param credentials: credentials to use instead of reading token.json, e.g. refreshed by a parent process.
+        :param filters: optional selective sync rules, a dict with include, exclude, min_size and max_size,
+        see SyncFilter. Audio and video are excluded when no exclude rules are given.
+        :param dedupe_hardlinks: copy identical files as hard links when the filesystem has no reflinks.
+        :param activity_page_size: activities requested per Drive Activity page.
+        :param changes_page_size: changes requested per Changes API page.
+        :param prefetch_pages: pages fetched on a background thread ahead of the page being processed.
+        :param max_rate: bytes per second all the downloads together may use, None for no cap.
+        :param rate_windows: time-of-day caps overriding max_rate, e.g. ["09:00-18:00=1M"], see BandwidthScheduler.
+        """
+        self.metrics = Metrics(metrics_file, prometheus_file)
+        self.cancel_requested = threading.Event()
+        self.requests = RequestExecutor(self.metrics, max_concurrency=download_workers * 2,
+                                        cancel_event=self.cancel_requested)
+        self.index_directory = index_directory
+        self.index = None
+        self.index_drive_id = None
+        self.chunk_size = chunk_size
+        self.download_journal = DownloadJournal(download_journal_file)
+        self.download_journal.load()
+        self.content_store = ContentStore(dedupe_hardlinks)
+        self.activity_page_size = activity_page_size
+        self.changes_page_size = changes_page_size
+        self.prefetch_pages = prefetch_pages
+        self.checkpoint = SyncCheckpoint(checkpoint_file)
+        self.checkpoint.load()
+        # the services are built on first use, so creating the client costs no import, token refresh or parsing
+        self.services = (None, drive_service, activity_service) if drive_service is not None else None
+        self.services_credentials = credentials
+        self.services_lock = threading.Lock()
+        self.sync_filter = SyncFilter.from_config(filters)
         self.events_manager = EventsManager()
+        self.bandwidth = BandwidthScheduler(download_workers, max_rate, rate_windows)
+        self.downloads = DownloadScheduler(download_workers + PREEMPTION_WORKERS, silent_errors=(SyncCancelled,))
+        self.thread_local = threading.local()
+        self.skip_lock = threading.Lock()
+        self.skipped_downloads = 0
+        self.skipped_bytes = 0
+        self.changes_applied = 0
+        # file IDs of the changes page not applied yet
+        self.pending_changes = set()
+        self.folder_cache = FolderCache(folder_cache_file)
+        self.folder_cache.load()
         self.last_timestamp = None
         self.local_directory = None
         self.drive_id = None
@@ -77,12 +149,80 @@ class GoogleDriveClient:
         self.drive_id = drive_id
         self.local_directory = directory
         self.last_timestamp = last_timestamp
+        self.cancel_requested.clear()
+
+        if self.index is not None and self.index_drive_id == drive_id:
+            return
+        if self.index is not None:
+            self.index.close()
+        self.index_drive_id = drive_id
+        if self.index_directory is None:
+            self.index = SyncIndex()
+        else:
+            os.makedirs(self.index_directory, exist_ok=True)
+            self.index = SyncIndex(os.path.join(self.index_directory, f"{drive_id}.db"))
+
+    def cancel(self):
+        """
+        Ask the running sync to stop, it stops before its next event or downloaded chunk.
+        :return: None.
+        """
+        self.cancel_requested.set()
+
+    def check_cancelled(self):
+        """
+        Stop the sync if it was cancelled.
+        :return: None.
+        """
+        if self.cancel_requested.is_set():
+            raise SyncCancelled()
+
+    def execute(self, request, name):
+        """
+        Execute an API request through the rate limits and retries, its latency is recorded under "api.<name>".
+        :param request: Google API request.
+        :param name: name of the API method.
+        :return: response.
+        """
+        try:
+            return self.requests.execute(request.execute, f"api.{name}")
+        except HttpError:
+            self.check_cancelled()
+            raise
+
+    def get_services(self):
+        """
+        Authenticate and build the Drive services the first time they are used.
+        :return: credentials, Drive service and Drive Activity service.
+        """
+        if self.services is None:
+            with self.services_lock:
+                if self.services is None:
+                    self.services = self.authenticate(self.services_credentials) or (None, None, None)
+        return self.services
+
+    @property
+    def credentials(self):
+        return self.get_services()[0]
+
+    @property
+    def drive_service(self):
+        return self.get_services()[1]
+
+    @property
+    def activity_service(self):
+        return self.get_services()[2]
 
     @staticmethod
-    def authenticate():
-        """Shows basic usage of the Drive v3 API.
-                Prints the names and ids of the first 10 files the user has access to.
-                """
+    def load_credentials():
+        """
+        Read the credentials from token.json, refreshing them or running the authorization flow if needed.
+        :return: valid credentials.
+        """
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
         creds = None
         # The file token.json stores the user's access and refresh tokens, and is
         # created automatically when the authorization flow completes for the first time.
@@ -99,88 +239,433 @@ class GoogleDriveClient:
             # Save the credentials for the next run
             with open('token.json', 'w') as token:
                 token.write(creds.to_json())
+        return creds
 
+    @staticmethod
+    def authenticate(creds=None):
+        """
+        Build the Drive and Drive Activity services from the discovery documents bundled with the client library,
+        nothing is fetched from the discovery endpoint.
+        :param creds: credentials to use, read from token.json if None.
+        :return: credentials, Drive service and Drive Activity service.
+        """
+        from googleapiclient.discovery import build
+
+        if creds is None:
+            creds = GoogleDriveClient.load_credentials()
         try:
-            drive_service = build('drive', 'v3', credentials=creds)
-            activity_service = build('driveactivity', 'v2', credentials=creds)
-            return drive_service, activity_service
+            drive_service = build('drive', 'v3', credentials=creds, static_discovery=True, cache_discovery=False)
+            activity_service = build('driveactivity', 'v2', credentials=creds, static_discovery=True,
+                                     cache_discovery=False)
+            return creds, drive_service, activity_service
         except HttpError as error:
             print('An error occurred: {}'.format(error))
 
-    @staticmethod
-    def list_files_in_folder(folder_id, service):
+    def list_files_in_folder(self, folder_id):
         """
         List all files in a folder.
         :param folder_id: folder ID.
-        :param service: Google Drive service.
         :return: list of files in the folder.
         """
-        return service.files().list(
-            q="'{}' in parents and trashed=false".format(folder_id),
-            fields="files(id, name, mimeType, parents)"
-        ).execute().get('files', [])
+        return self.list_files_in_folders([folder_id])
+
+    @timed("list_folders")
+    def list_files_in_folders(self, folder_ids):
+        """
+        List all files in some folders with one paged files.list query.
+        :param folder_ids: folder IDs, at most LIST_FOLDERS.
+        :return: list of files in the folders, with their FILE_FIELDS metadata.
+        """
+        query = " or ".join("'{}' in parents".format(folder_id) for folder_id in folder_ids)
+        files = []
+        page_token = None
+        while True:
+            self.check_cancelled()
+            response = self.execute(self.drive_service.files().list(
+                q="({}) and trashed=false".format(query),
+                pageSize=LIST_PAGE_SIZE,
+                pageToken=page_token,
+                fields=f"nextPageToken, files({FILE_FIELDS})"
+            ), "files.list")
+            files.extend(response.get('files', []))
+            page_token = response.get('nextPageToken')
+            if page_token is None:
+                return files
+
+    def relative_path(self, file_path):
+        """
+        Get the path of a file relative to the local directory, with "/" separators as in the filter rules.
+        :param file_path: local path.
+        :return: relative path.
+        """
+        return os.path.relpath(file_path, self.local_directory).replace(os.sep, "/")
+
+    def is_filtered(self, file_metadata):
+        """
+        Check a file or folder against the selective sync rules, before any folder is created for it.
+        :param file_metadata: file metadata with its directory.
+        :return: True if it is not synced, False otherwise.
+        """
+        if file_metadata.get('directory') is None:
+            return False
+        relative_path = "/".join(list(file_metadata['directory'][1:]) + [file_metadata['name']])
+        if file_metadata['mimeType'] == FOLDER_TYPE:
+            filtered = self.sync_filter.is_pruned(relative_path)
+        else:
+            filtered = self.sync_filter.is_excluded(relative_path, file_metadata['mimeType'],
+                                                    file_metadata.get('size'))
+        if filtered:
+            self.metrics.count("filtered")
+        return filtered
+
+    @timed("schedule_download")
+    def export_and_download_file(self, file_id, file_mime_type, file_path, file_metadata=None):
+        """
+        Schedule the download of a Document file in Its format on the download workers.
+        Small and recently edited files are downloaded first.
+        :param file_id: file ID of any workspace document format file.
+        :param file_mime_type: MIME type of the file to be downloaded.
+        :param file_path: path to download the file to.
+        :param file_metadata: file metadata, its md5Checksum and modifiedTime allow resuming the download.
+        :return: future of the download, None if skipped.
+        """
+        file_name = file_path.split("\\")[-1]
+        size = file_metadata.get('size') if file_metadata else None
+        if self.sync_filter.is_excluded(self.relative_path(file_path), file_mime_type, size):
+            if self.sync_filter.excludes_type(file_mime_type):
+                self.events_manager.update("skip_type", file_name, detail=file_mime_type.split('.')[-1])
+            else:
+                self.events_manager.update("skip_filter", file_name)
+            return None
+
+        self.checkpoint.set_file_status(file_id, PENDING)
+        modified_time = file_metadata.get('modifiedTime') if file_metadata else None
+        # exports are written with their extension, renames, moves and deletes wait on that path
+        local_path = file_path + EXTENSIONS.get(file_mime_type, "")
+        future = self.downloads.submit(local_path, self.download_file, file_id, file_mime_type, file_path,
+                                       file_metadata, priority=Transfer(size, modified_time).priority)
+        future.add_done_callback(lambda done_future: self.download_finished(file_id, done_future))
+        return future
+
+    def download_finished(self, file_id, future):
+        """
+        Record the status of a finished download in the checkpoint, cancelled downloads stay pending.
+        Only failures that may succeed later are retried by the next sync, e.g. server, quota or network errors,
+        a file that cannot be downloaded would fail again at every sync.
+        :param file_id: file ID.
+        :param future: future of the download.
+        :return: None.
+        """
+        if future.cancelled() or isinstance(future.exception(), SyncCancelled):
+            return
+        error = future.exception()
+        if error is None:
+            retry = future.result() is False
+        else:
+            # disk errors, e.g. a full disk, may also be gone by the next sync
+            retry = is_retriable(error) or isinstance(error, OSError)
+        self.checkpoint.set_file_status(file_id, FAILED if retry else None)
+
+    def thread_http(self):
+        """
+        Get an authorized HTTP object for the current thread, httplib2 objects are not thread safe.
+        :return: authorized HTTP object.
+        """
+        http = getattr(self.thread_local, 'http', None)
+        if http is None:
+            import httplib2
+            from google_auth_httplib2 import AuthorizedHttp
+
+            http = AuthorizedHttp(self.credentials, http=httplib2.Http())
+            self.thread_local.http = http
+        return http
+
+    def with_thread_http(self, request):
+        """
+        Send a request with the HTTP object of the current thread, for requests made outside the sync thread.
+        Injected services, e.g. an offline fake, keep their own HTTP object.
+        :param request: API request.
+        :return: the request.
+        """
+        if self.credentials is not None:
+            request.http = self.thread_http()
+        return request
+
+    def is_local_copy_current(self, file_id, file_path, file_metadata):
+        """
+        Check if the local copy of a file already has the content of its Drive revision.
+        Binary files are compared by md5Checksum, size and headRevisionId, using the index entry or
+        hashing the local file if it is not indexed. Google documents are compared by modifiedTime and version.
+        Skipped downloads and their bytes are counted.
+        :param file_id: file ID.
+        :param file_path: local path of the file, including the exported extension.
+        :param file_metadata: file metadata.
+        :return: True if the download can be skipped, False otherwise.
+        """
+        if not os.path.exists(file_path):
+            return False
+
+        local_size = os.path.getsize(file_path)
+        entry = self.index.get(file_id)
+        if entry is not None and entry['local_path'] != file_path:
+            entry = None
+
+        if file_metadata['mimeType'] in MIMETYPES:
+            current = (entry is not None and file_metadata.get('modifiedTime') is not None and
+                       entry['modified_time'] == file_metadata['modifiedTime'] and
+                       entry['version'] == self.to_int(file_metadata.get('version')))
+            skipped_bytes = local_size
+        else:
+            size = self.to_int(file_metadata.get('size'))
+            if file_metadata.get('md5Checksum') is None or local_size != size:
+                return False
+            if entry is not None and entry['md5_checksum'] == file_metadata['md5Checksum']:
+                current = (entry['head_revision_id'] is None or file_metadata.get('headRevisionId') is None or
+                           entry['head_revision_id'] == file_metadata['headRevisionId'])
+            else:
+                current = self.compute_md5(file_path) == file_metadata['md5Checksum']
+            skipped_bytes = size
+
+        if current:
+            if file_metadata['mimeType'] in MIMETYPES:
+                file_metadata = dict(file_metadata, md5Checksum=entry['md5_checksum'])
+            self.index.put(file_id, file_path, file_metadata, EXTENSIONS.get(file_metadata['mimeType'], ""))
+            with self.skip_lock:
+                self.skipped_downloads += 1
+                self.skipped_bytes += skipped_bytes
+        return current
 
     @staticmethod
-    def check_skip_regex(file_type):
-        for regex_pattern in SKIP_REGEX:
-            if re.match(regex_pattern, file_type):
-                return True
-        return False
+    def compute_md5(file_path):
+        """
+        Compute the MD5 checksum of a local file through a memory-mapped read.
+        :param file_path: local path of the file.
+        :return: hex digest.
+        """
+        md5 = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    md5.update(mapped)
+        return md5.hexdigest()
 
-    def export_and_download_file(self, file_id, file_mime_type, file_path):
+    @staticmethod
+    def to_int(value):
+        return int(value) if value is not None else None
+
+    def resume_partial_download(self, file_id, file_path, file_metadata):
+        """
+        Find the partial download of a file left by a previous run.
+        It is only reused if the remote revision did not change, otherwise it is discarded.
+        :param file_id: file ID.
+        :param file_path: path the file is downloaded to.
+        :param file_metadata: file metadata.
+        :return: temporary file path and number of bytes already downloaded, or (None, 0).
         """
-        Download a Document file in Its format.
+        record = self.download_journal.get(file_id)
+        if record is None:
+            return None, 0
+
+        temp_path = record['temp_path']
+        same_revision = (record['md5Checksum'] == file_metadata.get('md5Checksum') and
+                         record['modifiedTime'] == file_metadata.get('modifiedTime'))
+        if (same_revision and os.path.dirname(temp_path) == os.path.dirname(file_path) and
+                os.path.exists(temp_path) and os.path.getsize(temp_path) >= record['offset']):
+            return temp_path, record['offset']
+
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        self.download_journal.remove(file_id)
+        return None, 0
+
+    @timed("download")
+    def download_file(self, file_id, file_mime_type, file_path, file_metadata=None):
+        """
+        Download a Document file in Its format, runs on a download worker.
+        Binary files are keyed by their md5Checksum: a file identical to a local one is copied from it instead,
+        and identical files downloaded at the same time wait for the first download.
         :param file_id: file ID of any workspace document format file.
         :param file_mime_type: MIME type of the file to be downloaded.
         :param file_path: path to download the file to.
-        :return: IO object with location
+        :param file_metadata: file metadata.
+        :return: True if the file was downloaded or is up to date, False if the download failed and may succeed
+        later, None if it cannot succeed.
         """
+        md5_checksum = None
+        if file_metadata is not None and file_mime_type not in MIMETYPES:
+            md5_checksum = file_metadata.get('md5Checksum')
+        if md5_checksum is None:
+            return self.fetch_file(file_id, file_mime_type, file_path, file_metadata)
+
+        download = self.content_store.claim(md5_checksum)
+        while download is not None:
+            while not download.wait(0.5):
+                self.check_cancelled()
+            download = self.content_store.claim(md5_checksum)
+        try:
+            return self.fetch_file(file_id, file_mime_type, file_path, file_metadata)
+        finally:
+            self.content_store.release(md5_checksum)
+
+    def fetch_file(self, file_id, file_mime_type, file_path, file_metadata=None):
+        """
+        Download a file unless it is up to date or a local file has the same content.
+        Downloads of binary files are journaled after each chunk and resumed with a range request
+        if they are interrupted, exports cannot be resumed.
+        :param file_id: file ID.
+        :param file_mime_type: MIME type of the file to be downloaded.
+        :param file_path: path to download the file to.
+        :param file_metadata: file metadata.
+        :return: True if the file was downloaded, copied or is up to date, False if the download failed and may succeed
+        later, None if it cannot succeed, e.g. a file Drive does not let download.
+        """
+        from googleapiclient.http import MediaIoBaseDownload
 
         try:
             file_name = file_path.split("\\")[-1]
-            if file_mime_type in SKIP or self.check_skip_regex(file_mime_type):
-                self.events_manager.update("skip", f"<br><html><p style='color:{events_colors['skip']}'>"
-                                                   f"<b>Skipped</b> {file_name}"
-                                                   f" because of its type {file_mime_type.split('.')[-1]}.</p></html>")
-                return None
-            elif file_mime_type in MIMETYPES:
-                request = self.drive_service.files().export_media(fileId=file_id,
-                                                                  mimeType=MIMETYPES[file_mime_type])
+            if file_mime_type in MIMETYPES:
                 file_path += EXTENSIONS[file_mime_type]
                 file_name += EXTENSIONS[file_mime_type]
+
+            if file_metadata is not None and self.is_local_copy_current(file_id, file_path, file_metadata):
+                self.events_manager.update("skip_unchanged", file_name)
+                return True
+
+            if (file_metadata is not None and file_mime_type not in MIMETYPES and
+                    file_metadata.get('md5Checksum') is not None and
+                    self.copy_local_duplicate(file_id, file_path, file_metadata)):
+                return True
+
+            if file_mime_type in MIMETYPES:
+                request = self.drive_service.files().export_media(fileId=file_id,
+                                                                  mimeType=MIMETYPES[file_mime_type])
             else:
                 request = self.drive_service.files().get_media(fileId=file_id)
 
-            file = io.BytesIO()
-            downloader = MediaIoBaseDownload(file, request)
-            done = False
-            self.events_manager.update("download", f"<html><br><p style='color:{events_colors['download']}'>"
-                                                   f"Start Downloading <b>{file_name}</b>.</p>")
-            self.download_progress(done, downloader)
-            file.seek(0)
+            self.with_thread_http(request)
+
+            resumable = file_mime_type not in MIMETYPES and bool(file_metadata and file_metadata.get('md5Checksum'))
+            temp_path, offset = None, 0
+            if resumable:
+                temp_path, offset = self.resume_partial_download(file_id, file_path, file_metadata)
 
-            with open(file_path, 'wb') as f:
-                shutil.copyfileobj(file, f)
+            # write to a temporary file next to the target, so a crash never leaves a partial file under its name
+            if temp_path is None:
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=".", suffix=".part")
+                os.close(fd)
 
-            # take last 3 directories in path
-            shortened_file_path = "\\".join(file_path.split("\\")[-4:-1])
-            self.events_manager.update("done", f"<html><p style='color:{events_colors['done']}'>"
-                                               f"<b>Done</b> downloading"
-                                               f" {file_name} to {shortened_file_path}.</p></html>")
+            def journal_chunk(file, progress):
+                if resumable:
+                    file.flush()
+                    self.download_journal.record(file_id, temp_path, progress,
+                                                 file_metadata['md5Checksum'], file_metadata.get('modifiedTime'))
+
+            try:
+                with open(temp_path, 'r+b') as file:
+                    file.truncate(offset)
+                    file.seek(offset)
+                    downloader = MediaIoBaseDownload(file, request, chunksize=self.chunk_size)
+                    # the downloader asks for the range starting at its progress
+                    downloader._progress = offset
+                    done = offset > 0 and offset >= int(file_metadata.get('size', -1))
+                    transfer = Transfer(file_metadata.get('size') if resumable else None,
+                                        file_metadata.get('modifiedTime') if file_metadata else None, offset)
+                    if offset > 0:
+                        self.events_manager.update("resume", file_name, detail=offset)
+                    else:
+                        self.events_manager.update("download", file_name)
+                    self.download_progress(done, downloader, file_name, transfer,
+                                           lambda progress: journal_chunk(file, progress))
+                os.replace(temp_path, file_path)
+                self.download_journal.remove(file_id)
+                index_metadata = file_metadata or {'mimeType': file_mime_type}
+                if file_mime_type in MIMETYPES:
+                    # exports have no Drive checksum, the local one tells the uploads this copy is unchanged
+                    index_metadata = dict(index_metadata, md5Checksum=self.compute_md5(file_path))
+                self.index.put(file_id, file_path, index_metadata, EXTENSIONS.get(file_mime_type, ""))
+            except BaseException:
+                # keep journaled partial downloads for the next run
+                if not resumable or self.download_journal.get(file_id) is None:
+                    os.remove(temp_path)
+                raise
+
+            self.events_manager.update("done", file_name, os.path.dirname(file_path))
+            return True
 
         except HttpError as error:
             print('An error occurred: {}'.format(error))
+            return False if is_retriable(error) else None
+
+    def copy_local_duplicate(self, file_id, file_path, file_metadata):
+        """
+        Make a file from an indexed local file with the same md5Checksum instead of downloading it.
+        The local file is hashed again first, it may have been edited since it was indexed.
+        :param file_id: file ID.
+        :param file_path: path of the new file.
+        :param file_metadata: file metadata with md5Checksum and size.
+        :return: True if the file was copied, False otherwise.
+        """
+        size = self.to_int(file_metadata.get('size'))
+        for source in self.index.find_checksum(file_metadata['md5Checksum'], size):
+            if (source == file_path or not os.path.isfile(source) or os.path.getsize(source) != size or
+                    self.compute_md5(source) != file_metadata['md5Checksum']):
+                continue
+
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=".", suffix=".part")
+            os.close(fd)
+            os.remove(temp_path)
+            try:
+                with self.metrics.measure("filesystem.clone"):
+                    method = self.content_store.clone(source, temp_path)
+                os.replace(temp_path, file_path)
+            except OSError as error:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                print('An error occurred: {}'.format(error))
+                return False
+
+            self.index.put(file_id, file_path, file_metadata)
+            self.metrics.count("deduplicated_files")
+            self.metrics.count("deduplicated_bytes", size)
+            self.events_manager.update("dedupe", os.path.basename(file_path), os.path.dirname(file_path),
+                                       detail=method)
+            return True
+        return False
 
-    def download_progress(self, done, downloader):
+    def download_progress(self, done, downloader, file_name, transfer, on_chunk=None):
+        """
+        Download the chunks of a file, each one waits for the bandwidth scheduler, so a large download is preempted
+        between two chunks when smaller files are waiting.
+        :param done: True if the file is already complete.
+        :param downloader: MediaIoBaseDownload.
+        :param file_name: file name shown in the events.
+        :param transfer: Transfer of the download.
+        :param on_chunk: optional function called with the progress in bytes after each chunk.
+        :return: None.
+        """
         while not done:
-            status, done = downloader.next_chunk()
+            self.check_cancelled()
+            self.metrics.observe("bandwidth_wait", self.bandwidth.acquire(transfer, self.check_cancelled))
+            previous_progress = downloader._progress
+            downloader._chunksize = self.bandwidth.chunk_size(self.chunk_size)
+            try:
+                status, done = self.requests.execute(downloader.next_chunk, "api.download_chunk")
+            except HttpError:
+                self.check_cancelled()
+                raise
+            finally:
+                self.bandwidth.release(downloader._progress - previous_progress)
+            transfer.progress = downloader._progress
+            if transfer.size is None and status.total_size:
+                transfer.size = status.total_size
+            self.metrics.count("bytes_downloaded", downloader._progress - previous_progress)
+            if on_chunk is not None:
+                on_chunk(status.resumable_progress)
             if done:
                 progress = 100
             else:
                 progress = int(status.progress() * 100)
-            self.events_manager.update("download", f"<html><p style='color:{events_colors['download']}'>"
-                                                   f"<b>Downloading</b> {progress}%.</p>"
-                                                   f"</html>")
+            self.events_manager.update("progress", file_name, progress=progress)
 
     @staticmethod
     def build_real_link_if_shortcut(file_metadata):
@@ -208,6 +693,7 @@ class GoogleDriveClient:
             file_metadata['id'] = file_metadata['shortcutDetails']['targetId']
         return file_metadata
 
+    @timed("build_file_metadata")
     def build_file_metadata(self, new_file_id):
         """
         Build the metadata of a file.
@@ -215,17 +701,28 @@ class GoogleDriveClient:
         :return: file metadata.
         """
         try:
-            file_metadata = self.drive_service.files().get(
+            file_metadata = self.execute(self.drive_service.files().get(
                 fileId=new_file_id,
-                fields="id, name, mimeType, webViewLink, parents, shortcutDetails, trashed"
-            ).execute()
+                fields=FILE_FIELDS
+            ), "files.get")
         except HttpError as error:
             print('An error occurred: {}'.format(error))
             return None
 
-        if not file_metadata['parents'] or file_metadata['trashed']:
+        return self.complete_file_metadata(file_metadata)
+
+    def complete_file_metadata(self, file_metadata):
+        """
+        Add the local directory to fetched file metadata and resolve shortcuts.
+        :param file_metadata: file metadata as returned by Drive.
+        :return: file metadata.
+        """
+        if not file_metadata.get('parents') or file_metadata['trashed']:
             return file_metadata
 
+        if file_metadata['mimeType'] == FOLDER_TYPE:
+            self.folder_cache.put_metadata(file_metadata)
+
         file_parents_names = self.build_file_path(file_metadata=file_metadata)
 
         if file_metadata.get('shortcutDetails'):
@@ -236,18 +733,152 @@ class GoogleDriveClient:
 
         return new_file_metadata
 
+    def execute_batch(self, requests):
+        """
+        Execute requests through batch HTTP requests of up to BATCH_SIZE calls.
+        Calls of a batch failing with a retriable error are sent again in a later batch.
+        :param requests: dict of request ID to request.
+        :return: dict of request ID to response, failed requests are left out.
+        """
+        responses = {}
+        retries = {}
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                responses[request_id] = response
+            elif is_retriable(exception) and attempt < self.requests.max_retries:
+                retries[request_id] = exception
+            else:
+                print('An error occurred: {}'.format(exception))
+
+        attempt = 0
+        items = list(requests.items())
+        while items:
+            for start in range(0, len(items), BATCH_SIZE):
+                batch = self.drive_service.new_batch_http_request(callback=callback)
+                for request_id, request in items[start:start + BATCH_SIZE]:
+                    # a batch is sent through the HTTP object of its first request, the uploads batch on their thread
+                    batch.add(self.with_thread_http(request), request_id=request_id)
+                self.metrics.count("batched_calls", len(items[start:start + BATCH_SIZE]))
+                try:
+                    self.execute(batch, "batch")
+                except HttpError as error:
+                    print('An error occurred: {}'.format(error))
+
+            if not retries:
+                break
+            if any(is_throttled(error) for error in retries.values()):
+                self.requests.concurrency.throttle()
+            self.requests.backoff(attempt, next(iter(retries.values())))
+            self.check_cancelled()
+            items = [(request_id, requests[request_id]) for request_id in retries]
+            retries.clear()
+            attempt += 1
+
+        return responses
+
+    def resolve_folders(self, folder_ids):
+        """
+        Fetch the uncached folders and their uncached ancestors into the folder cache.
+        Each level of the tree is fetched with one batch request.
+        :param folder_ids: folder IDs.
+        :return: None.
+        """
+        pending = {folder_id for folder_id in folder_ids if folder_id not in self.folder_cache}
+        while pending:
+            folders = self.execute_batch({
+                folder_id: self.drive_service.files().get(fileId=folder_id, fields="id, name, parents")
+                for folder_id in pending
+            })
+            pending = set()
+            for folder in folders.values():
+                self.folder_cache.put_metadata(folder)
+                parents = folder.get('parents')
+                if parents and folder['name'] != self.home['name'] and parents[0] not in self.folder_cache:
+                    pending.add(parents[0])
+
+    @timed("resolve_metadata")
+    def resolve_page_metadata(self, activities):
+        """
+        Resolve the metadata of every target of an activity page with batch requests.
+        The ancestors are resolved as well, so the directories are built from the folder cache.
+        :param activities: Google Drive Activity objects.
+        :return: dict of file ID to file metadata.
+        """
+        file_ids = set()
+        folder_ids = set()
+        for activity in activities:
+            for target in activity['targets']:
+                # excluded names and types are dropped before their metadata is fetched
+                drive_item = target['driveItem']
+                if self.sync_filter.excludes_file(drive_item.get('title', ""), drive_item.get('mimeType')):
+                    self.metrics.count("filtered")
+                    continue
+                file_ids.add(self.get_item_id(drive_item))
+            move_action = activity['primaryActionDetail'].get('move')
+            if move_action:
+                for parent in move_action.get('removedParents', []) + move_action.get('addedParents', []):
+                    folder_ids.add(self.get_item_id(parent['driveItem']))
+
+        files = self.execute_batch({
+            file_id: self.drive_service.files().get(fileId=file_id, fields=FILE_FIELDS)
+            for file_id in file_ids
+        })
+        for file_metadata in files.values():
+            if not file_metadata.get('parents') or file_metadata['trashed']:
+                continue
+            if file_metadata['mimeType'] == FOLDER_TYPE:
+                self.folder_cache.put_metadata(file_metadata)
+            folder_ids.add(file_metadata['parents'][0])
+
+        self.resolve_folders(folder_ids)
+
+        return {file_id: self.complete_file_metadata(file_metadata) for file_id, file_metadata in files.items()}
+
+    @staticmethod
+    def get_item_id(drive_item):
+        """
+        Get the file ID of a Drive Activity item.
+        :param drive_item: Drive Activity item, its name is "items/<file ID>".
+        :return: file ID.
+        """
+        return drive_item['name'].split('/')[1]
+
+    def get_folder(self, folder_id):
+        """
+        Get the name and parent of a folder, from the folder cache if possible.
+        :param folder_id: folder ID.
+        :return: (name, parent ID) or None if the folder could not be fetched.
+        """
+        folder = self.folder_cache.get(folder_id)
+        if folder is not None:
+            return folder
+
+        try:
+            folder_metadata = self.execute(self.drive_service.files().get(
+                fileId=folder_id,
+                fields="id, name, parents"
+            ), "files.get")
+        except HttpError as error:
+            print('An error occurred: {}'.format(error))
+            return None
+
+        return self.folder_cache.put_metadata(folder_metadata)
+
+    @timed("build_file_path")
     def build_file_path(self, file_id="", file_metadata=None):
         """
         Build the path to a file.
-        :param file_id: file ID.
+        The ancestors are resolved through the folder cache, so only uncached folders cost an API call.
+        :param file_id: folder ID.
         :param file_metadata: file metadata.
         :return: path to the file.
         """
         if not file_metadata:
-            file_metadata = self.drive_service.files().get(
-                fileId=file_id,
-                fields="id, name, mimeType, parents, shortcutDetails"
-            ).execute()
+            folder = self.get_folder(file_id)
+            if folder is None:
+                return None
+            file_metadata = {'id': file_id, 'name': folder[0], 'parents': [folder[1]] if folder[1] else []}
 
         if file_metadata['name'] == self.home['name']:
             return [self.local_directory]
@@ -255,28 +886,24 @@ class GoogleDriveClient:
         file_parents_names = []
         file_parent_id = file_metadata['parents'][0]
         while True:
-            try:
-                parent_metadata = self.drive_service.files().get(
-                    fileId=file_parent_id,
-                    fields="id, name, parents"
-                ).execute()
-            except HttpError as error:
-                print('An error occurred: {}'.format(error))
+            parent = self.get_folder(file_parent_id)
+            if parent is None:
                 return None
 
-            parent_name = parent_metadata['name']
+            parent_name, grandparent_id = parent
 
-            if not parent_metadata.get('parents') or parent_name == self.home['name']:
+            if grandparent_id is None or parent_name == self.home['name']:
                 break
             else:
                 file_parents_names.append(parent_name)
-                file_parent_id = parent_metadata['parents'][0]
+                file_parent_id = grandparent_id
 
         file_parents_names.append(self.local_directory)
         file_parents_names.reverse()
 
         return file_parents_names
 
+    @timed("pull_changes")
     def pull_changes_with_limit(self, timestamp, page_size=100, page_token=None):
         """
         Pull changes from Google Drive with a limit.
@@ -295,9 +922,38 @@ class GoogleDriveClient:
         if page_token is not None:
             request_body['pageToken'] = page_token
 
-        return self.activity_service.activity().query(
+        # pages are fetched on the prefetch thread, beside the requests of the sync thread
+        return self.execute(self.with_thread_http(self.activity_service.activity().query(
             body=request_body
-        ).execute()
+        )), "activity.query")
+
+    def pull_all_changes(self):
+        """
+        Pull every activity page since the last timestamp and resolve the metadata of their targets.
+        The next pages are fetched in the background while the metadata of a page is resolved.
+        :return: activities in chronological order and a dict of file ID to file metadata.
+        """
+        def fetch_page(page_token):
+            self.check_cancelled()
+            return self.pull_changes_with_limit(self.last_timestamp, self.activity_page_size, page_token)
+
+        def next_page_token(changed_files):
+            if self.is_activities_data_empty(changed_files):
+                return None
+            return changed_files.get('nextPageToken')
+
+        activities = []
+        metadata = {}
+        for changed_files in PagePrefetcher(fetch_page, next_page_token, depth=self.prefetch_pages):
+            if self.is_activities_data_empty(changed_files):
+                break
+            self.invalidate_folder_cache(changed_files['activities'])
+            metadata.update(self.resolve_page_metadata(changed_files['activities']))
+            activities.extend(changed_files['activities'])
+
+        # activities are returned newest first
+        activities.reverse()
+        return activities, metadata
 
     @staticmethod
     def is_activities_data_empty(activities_data):
@@ -309,6 +965,19 @@ class GoogleDriveClient:
         return (not activities_data or not activities_data['activities'] or
                 len(activities_data['activities']) == 0)
 
+    def invalidate_folder_cache(self, activities):
+        """
+        Drop the folders renamed, moved or deleted by the activities from the folder cache.
+        :param activities: Google Drive Activity objects.
+        :return: None.
+        """
+        for activity in activities:
+            action = list(activity['primaryActionDetail'].keys())[0]
+            if action not in ('rename', 'move', 'delete'):
+                continue
+            for target in activity['targets']:
+                self.folder_cache.invalidate(self.get_item_id(target['driveItem']))
+
     @staticmethod
     def create_missing_folders(file_metadata):
         """
@@ -325,6 +994,7 @@ class GoogleDriveClient:
                 print(f"created {folder}")
         return path
 
+    @sync_run("activity")
     def get_changes_and_download(self, call_timestamp):
         """
         Get changes from Google Drive and sync them.
@@ -336,59 +1006,454 @@ class GoogleDriveClient:
         :param call_timestamp: timestamp of the call.
         :return: None.
         """
-        self.events_manager.update("start", f"<html><h2 style='color:{events_colors['start']}'>"
-                                            f"Syncing...</h2></html>")
+        self.events_manager.update("start")
 
-        self.home = self.drive_service.files().get(
+        self.home = self.execute(self.drive_service.files().get(
             fileId=self.drive_id,
             fields="name, createdTime"
-        ).execute()
+        ), "files.get")
 
+        if self.checkpoint.resume(self.drive_id, self.last_timestamp) and self.checkpoint.timestamp is not None:
+            print(f"resuming the interrupted sync from {self.checkpoint.timestamp}")
+            self.last_timestamp = self.checkpoint.timestamp
         if self.last_timestamp == "":
-            self.last_timestamp = self.home['createdTime']
+            self.download_snapshot(call_timestamp)
+            return
 
         current_timestamp = call_timestamp
-        changed_files = self.pull_changes_with_limit(self.last_timestamp, 200)
+        self.skipped_downloads = 0
+        self.skipped_bytes = 0
+        self.changes_applied = 0
+        self.retry_unfinished_files()
+        activities, metadata = self.pull_all_changes()
+
+        if len(activities) == 0:
+            self.events_manager.update("no_changes")
+            with self.metrics.measure("wait_downloads"):
+                self.downloads.wait_all()
+            # a download cancelled while waiting leaves the sync unfinished, its checkpoint must not move
+            self.check_cancelled()
+            self.last_timestamp = current_timestamp
+            self.save_checkpoint(timestamp=current_timestamp)
+            return
 
-        while True:
-            if self.is_activities_data_empty(changed_files):
-                self.events_manager.update("skip", f"<html><br><h3 style='color:{events_colors['skip']}'>"
-                                                   f"No changes to sync.</h3></html>")
-                self.last_timestamp = current_timestamp
-                return
+        items = []
+        timestamp_format = "%Y-%m-%dT%H:%M:%S.%fZ"
+        for activity in activities:
+            print(f"activity: {activity}")
+            for target in activity['targets']:
+                file_id = self.get_item_id(target['driveItem'])
+                timestamp = activity['timestamp']
+
+                last_timestamp_datetime, timestamp_datetime = self.build_timestamps(timestamp, timestamp_format)
+
+                if timestamp_datetime < last_timestamp_datetime:
+                    print(f"this file id: {file_id} should have been notified before")
+                    continue
+
+                items.append((activity, file_id))
+
+        planner = SyncPlanner()
+        with self.metrics.measure("plan"):
+            plan = planner.plan(items)
+        self.changes_applied = len(plan)
+        print(f"planned {len(plan)} events, coalesced away {planner.removed}")
+        self.events_manager.update("plan", detail=f"{len(plan)} changes to sync,"
+                                                  f" {planner.removed} redundant changes skipped.")
+
+        for index, (activity, file_id) in enumerate(plan):
+            self.check_cancelled()
+            if index > 0 and index % self.activity_page_size == 0:
+                # everything before this activity is applied, replaying from its timestamp is harmless
+                self.save_checkpoint(timestamp=activity['timestamp'])
+            file_metadata = metadata.get(file_id)
+            action = planner.get_action(activity)
+            if file_metadata is None or file_metadata['trashed']:
+                # trashed or deleted forever, the metadata has no path left, the index knows where the file is
+                if action == 'delete':
+                    self.delete_indexed(file_id)
+                continue
+
+            if self.is_filtered(file_metadata):
+                continue
+
+            # the parent is found by ID where the replay has put it so far, its Drive path may only hold later names
+            path = self.indexed_parent_path(file_metadata)
+            if path is None:
+                path = os.path.join(*file_metadata['directory'])
+                if action != 'delete' and action != 'rename':
+                    path = self.create_missing_folders(file_metadata['directory'])
+
+            self.event_factory(action, activity, file_metadata, path)
+
+        with self.metrics.measure("wait_downloads"):
+            self.downloads.wait_all()
+        self.check_cancelled()
+        self.last_timestamp = current_timestamp
+        self.save_checkpoint(timestamp=current_timestamp)
+        print(f"{self.last_timestamp}\tupdated at the end of the call")
+        print(f"folder cache: {self.folder_cache.hits} hits, {self.folder_cache.misses} misses")
+        print(f"skipped {self.skipped_downloads} unchanged downloads, {self.skipped_bytes} bytes")
+        self.count_run_totals()
+        self.events_manager.update("sync_done", detail=f"{self.skipped_downloads} unchanged files were not"
+                                                       f" downloaded again ({self.skipped_bytes} bytes).")
+
+    def save_checkpoint(self, timestamp=None, page_token=None):
+        """
+        Save the position of the sync with the folder cache, so the cache matches the applied changes.
+        :param timestamp: timestamp of the next activity to apply, for the Drive Activity sync.
+        :param page_token: page token of the next changes page, for the Changes API sync.
+        :return: None.
+        """
+        # the filter and build_timestamps expect fractional seconds
+        if timestamp is not None and '.' not in timestamp:
+            timestamp = timestamp[:-1] + '.000Z'
+        self.folder_cache.save()
+        with self.metrics.measure("checkpoint"):
+            self.checkpoint.save(timestamp, page_token)
+
+    def retry_unfinished_files(self):
+        """
+        Download again the files whose download was pending when the last sync stopped or failed.
+        :return: None.
+        """
+        file_ids = self.checkpoint.unfinished_files()
+        if not file_ids:
+            return
+        files = self.execute_batch({
+            file_id: self.drive_service.files().get(fileId=file_id, fields=FILE_FIELDS)
+            for file_id in file_ids
+        })
+        self.resolve_folders({file_metadata['parents'][0] for file_metadata in files.values()
+                              if file_metadata.get('parents')})
+
+        for file_id in file_ids:
+            self.check_cancelled()
+            self.checkpoint.set_file_status(file_id, None)
+            file_metadata = files.get(file_id)
+            if (file_metadata is None or file_metadata['trashed'] or file_metadata['mimeType'] == FOLDER_TYPE or
+                    not self.is_in_sync_folder(file_metadata)):
+                continue
+            file_metadata = self.complete_file_metadata(file_metadata)
+            if file_metadata.get('directory') is None or self.is_filtered(file_metadata):
+                continue
+
+            path = self.create_missing_folders(file_metadata['directory'])
+            self.export_and_download_file(file_metadata['id'], file_metadata['mimeType'],
+                                          os.path.join(path, file_metadata['name']), file_metadata)
+
+    def download_snapshot(self, call_timestamp):
+        """
+        First sync: download the current tree instead of replaying the whole activity history of the folder.
+        The tree is listed breadth first, LIST_FOLDERS folders per query, folders are created as they are
+        listed and files are downloaded on the download workers. Local copies already up to date are kept.
+        :param call_timestamp: timestamp of the call, the next sync replays the changes made since.
+        :return: None.
+        """
+        self.skipped_downloads = 0
+        self.skipped_bytes = 0
+        folders_count = 0
+        files_count = 0
+
+        # the root is where the paths built from the folder cache stop
+        self.folder_cache.put(self.drive_id, self.home['name'], None)
+        level = {self.drive_id: self.local_directory}
+        while level:
+            next_level = {}
+            folder_ids = list(level)
+            for start in range(0, len(folder_ids), LIST_FOLDERS):
+                for file_metadata in self.list_files_in_folders(folder_ids[start:start + LIST_FOLDERS]):
+                    path = level[file_metadata['parents'][0]]
+                    file_path = os.path.join(path, file_metadata['name'])
+                    if file_metadata['mimeType'] == FOLDER_TYPE:
+                        if self.sync_filter.is_pruned(self.relative_path(file_path)):
+                            # the subtree is never listed
+                            self.metrics.count("filtered")
+                            continue
+                        self.folder_cache.put_metadata(file_metadata)
+                        if not os.path.exists(file_path):
+                            with self.metrics.measure("filesystem.mkdir"):
+                                os.mkdir(file_path)
+                            self.events_manager.update("create", file_metadata['name'], path)
+                        self.index.put(file_metadata['id'], file_path, file_metadata)
+                        next_level[file_metadata['id']] = file_path
+                        folders_count += 1
+                    else:
+                        if file_metadata.get('shortcutDetails'):
+                            file_metadata = self.build_real_link_if_shortcut(file_metadata)
+                        if self.sync_filter.is_excluded(self.relative_path(file_path), file_metadata['mimeType'],
+                                                        file_metadata.get('size')):
+                            self.metrics.count("filtered")
+                            continue
+                        self.export_and_download_file(file_metadata['id'], file_metadata['mimeType'], file_path,
+                                                      file_metadata)
+                        files_count += 1
+            level = next_level
+
+        with self.metrics.measure("wait_downloads"):
+            self.downloads.wait_all()
+        self.check_cancelled()
+        self.last_timestamp = call_timestamp
+        self.save_checkpoint(timestamp=call_timestamp)
+        self.changes_applied = folders_count + files_count
+        print(f"snapshot of {folders_count} folders and {files_count} files")
+        print(f"skipped {self.skipped_downloads} unchanged downloads, {self.skipped_bytes} bytes")
+        self.count_run_totals()
+        self.events_manager.update("sync_done", detail=f"First sync of {folders_count} folders and {files_count}"
+                                                       f" files, {self.skipped_downloads} unchanged files were not"
+                                                       f" downloaded again ({self.skipped_bytes} bytes).")
+
+    @sync_run("changes")
+    def sync_changes(self, page_token, call_timestamp):
+        """
+        Sync with the Drive v3 Changes API, an alternative to the Drive Activity polling.
+        Changes carry the file metadata inline and resume exactly at the saved page token.
+        Without a page token, a start page token is taken first and the Drive Activity sync
+        covers everything before it.
+        :param page_token: start page token saved by the previous call, empty for the first call.
+        :param call_timestamp: timestamp of the call.
+        :return: start page token for the next call.
+        """
+        if page_token == "":
+            new_page_token = self.execute(self.drive_service.changes().getStartPageToken(),
+                                          "changes.getStartPageToken")['startPageToken']
+            self.get_changes_and_download(call_timestamp)
+            return new_page_token
+
+        self.events_manager.update("start")
+
+        self.home = self.execute(self.drive_service.files().get(
+            fileId=self.drive_id,
+            fields="name, createdTime"
+        ), "files.get")
+        self.skipped_downloads = 0
+        self.skipped_bytes = 0
+        if self.checkpoint.resume(self.drive_id, page_token) and self.checkpoint.page_token is not None:
+            print(f"resuming the interrupted sync from page token {self.checkpoint.page_token}")
+            page_token = self.checkpoint.page_token
+        self.retry_unfinished_files()
+
+        def fetch_page(token):
+            self.check_cancelled()
+            with self.metrics.measure("pull_changes"):
+                return self.execute(self.with_thread_http(self.drive_service.changes().list(
+                    pageToken=token,
+                    pageSize=self.changes_page_size,
+                    includeRemoved=True,
+                    spaces='drive',
+                    fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, time, file({FILE_FIELDS}))"
+                )), "changes.list")
+
+        def next_page_token(changes_data):
+            if changes_data.get('newStartPageToken') is not None:
+                return None
+            return changes_data['nextPageToken']
+
+        # the next page is fetched in the background while a page is applied
+        changes_count = 0
+        for changes_data in PagePrefetcher(fetch_page, next_page_token, page_token, self.prefetch_pages):
+            changes = changes_data.get('changes', [])
+            changes_count += len(changes)
+
+            self.prepare_changes_page(changes)
+            self.pending_changes = {change['fileId'] for change in changes}
+            for change in self.order_changes(changes):
+                self.check_cancelled()
+                self.apply_change(change)
+
+            if changes_data.get('newStartPageToken') is not None:
+                page_token = changes_data['newStartPageToken']
+                break
+            page_token = changes_data['nextPageToken']
+            self.save_checkpoint(page_token=page_token)
+
+        with self.metrics.measure("wait_downloads"):
+            self.downloads.wait_all()
+        self.check_cancelled()
+        self.last_timestamp = call_timestamp
+        self.save_checkpoint(page_token=page_token)
+        self.changes_applied = changes_count
+        print(f"{changes_count} changes applied, next page token {page_token}")
+        print(f"skipped {self.skipped_downloads} unchanged downloads, {self.skipped_bytes} bytes")
+        self.count_run_totals()
+        self.events_manager.update("sync_done", detail=f"{self.skipped_downloads} unchanged files were not"
+                                                       f" downloaded again ({self.skipped_bytes} bytes).")
+        return page_token
+
+    def count_run_totals(self):
+        """
+        Add the totals of the sync to its metrics.
+        :return: None.
+        """
+        self.metrics.count("changes_applied", self.changes_applied)
+        self.metrics.count("skipped_downloads", self.skipped_downloads)
+        self.metrics.count("skipped_bytes", self.skipped_bytes)
 
-            timestamp_format = "%Y-%m-%dT%H:%M:%S.%fZ"
-            for activity in reversed(changed_files['activities']):
-                print(f"activity: {activity}")
-                for target in activity['targets']:
-                    file_id = target['driveItem']['name'].split('/')[1]
-                    timestamp = activity['timestamp']
+    def prepare_changes_page(self, changes):
+        """
+        Refresh the folder cache with the folders of a changes page and fetch the missing ancestors.
+        :param changes: Drive changes.
+        :return: None.
+        """
+        parent_ids = set()
+        for change in changes:
+            file = change.get('file')
+            if change.get('removed') or file is None or file.get('trashed'):
+                self.folder_cache.invalidate(change['fileId'])
+                continue
+            if self.is_excluded_change(file):
+                continue
+            if file['mimeType'] == FOLDER_TYPE:
+                self.folder_cache.put_metadata(file)
+            if file.get('parents'):
+                parent_ids.add(file['parents'][0])
+        self.resolve_folders(parent_ids)
+
+    def is_excluded_change(self, file):
+        """
+        Check the rules that need no path against the file of a change, an excluded file costs no folder lookup.
+        :param file: file metadata of the change.
+        :return: True if the file is excluded.
+        """
+        return self.sync_filter.excludes_file(file['name'], file['mimeType'], file.get('size'))
 
-                    last_timestamp_datetime, timestamp_datetime = self.build_timestamps(timestamp, timestamp_format)
+    def order_changes(self, changes):
+        """
+        Order a changes page so folders are applied before files, parents before children, and removals last.
+        A renamed or moved folder then carries its local content along before the files inside it are applied,
+        and a folder moved out of a trashed folder is moved before the trashed folder is deleted.
+        :param changes: Drive changes.
+        :return: ordered Drive changes.
+        """
+        def folder_depth(change):
+            if self.is_removal(change):
+                return 2, 0
+            file = change['file']
+            if file['mimeType'] != FOLDER_TYPE or not file.get('parents'):
+                return 1, 0
+            depth = 0
+            parent_id = file['parents'][0]
+            while parent_id is not None and parent_id != self.drive_id:
+                # read once, the upload thread may drop the folder meanwhile
+                folder = self.folder_cache.folders.get(parent_id)
+                if folder is None:
+                    break
+                depth += 1
+                parent_id = folder[1]
+            return 0, depth
+
+        return sorted(changes, key=folder_depth)
+
+    def is_in_sync_folder(self, file_metadata):
+        """
+        Check if a file is under the synced Drive folder.
+        :param file_metadata: file metadata.
+        :return: True if it is, False otherwise.
+        """
+        parents = file_metadata.get('parents')
+        parent_id = parents[0] if parents else None
+        while parent_id is not None:
+            if parent_id == self.drive_id:
+                return True
+            folder = self.get_folder(parent_id)
+            if folder is None:
+                return False
+            parent_id = folder[1]
+        return False
 
-                    if timestamp_datetime.date() < last_timestamp_datetime.date():
-                        print(f"this file id: {file_id} should have been notified before")
-                        continue
+    def delete_indexed(self, file_id):
+        """
+        Delete the local copy of a file or folder found in the index.
+        :param file_id: file ID.
+        :return: None.
+        """
+        indexed_path = self.index.get_path(file_id)
+        if indexed_path is not None:
+            mime_type = FOLDER_TYPE if os.path.isdir(indexed_path) else ""
+            self.delete_event({'id': file_id, 'name': os.path.basename(indexed_path), 'mimeType': mime_type},
+                              os.path.dirname(indexed_path))
 
-                    file_metadata = self.build_file_metadata(file_id)
-                    if file_metadata is None or file_metadata['trashed']:
-                        continue
+    def is_removal(self, change):
+        """
+        Check if a change removes its file from the local directory: removed, trashed or moved out of the synced folder.
+        :param change: Drive change.
+        :return: True if the file is deleted locally.
+        """
+        file = change.get('file')
+        return change.get('removed') or file is None or file.get('trashed') or not self.is_in_sync_folder(file)
 
-                    action = list(activity['primaryActionDetail'].keys())[0]
-                    path = os.path.join(*file_metadata['directory'])
-                    if action != 'delete' and action != 'rename':
-                        path = self.create_missing_folders(file_metadata['directory'])
+    def apply_change(self, change):
+        """
+        Apply one change of the Changes API to the local directory.
+        The net state is applied: removed and trashed files are deleted, files whose path changed are
+        moved, and new or changed files are downloaded.
+        :param change: Drive change.
+        :return: None.
+        """
+        file_id = change['fileId']
+        file = change.get('file')
+        self.pending_changes.discard(file_id)
+        indexed_path = self.index.get_path(file_id)
+
+        if file is not None and not change.get('removed') and not file.get('trashed') and (
+                indexed_path is None and self.is_excluded_change(file)):
+            self.metrics.count("filtered")
+            return
 
-                    self.event_factory(action, activity, file_metadata, path)
+        if self.is_removal(change):
+            self.delete_indexed(file_id)
+            return
 
-            if changed_files.get('nextPageToken') is None:
-                break
-            changed_files = self.pull_changes_with_limit(self.last_timestamp, 200, changed_files['nextPageToken'])
+        file_metadata = self.complete_file_metadata(file)
+        if file_metadata.get('directory') is None or self.is_filtered(file_metadata):
+            return
 
-        self.last_timestamp = current_timestamp
-        print(f"{self.last_timestamp}\tupdated at the end of the call")
-        self.events_manager.update("done", f"<html><br><h3 style='color:{events_colors['done']}'>"
-                                           f"Syncing done.</h3></html>")
+        path = self.create_missing_folders(file_metadata['directory'])
+        file_path = os.path.join(path, file_metadata['name'])
+        extension = EXTENSIONS.get(file_metadata['mimeType'], "")
+        local_path = file_path + extension
+
+        entry = self.index.find(local_path)
+        if (entry is not None and entry['file_id'] != file_id and entry['file_id'] in self.pending_changes and
+                os.path.exists(local_path)):
+            # the file holding the path moves later in the page, e.g. a swap, it waits under a hidden name
+            self.move_local_path(local_path, os.path.join(path, f".{entry['file_id']}.moving"))
+            entry = None
+
+        if indexed_path is not None and indexed_path != local_path:
+            if entry is not None and entry['file_id'] != file_id and os.path.exists(local_path):
+                # Drive allows siblings with the same name, the local copy keeps its old path
+                print(f"not moving {indexed_path}, {local_path} is another Drive file")
+                if file_metadata['mimeType'] == FOLDER_TYPE:
+                    return
+                file_path = indexed_path[:len(indexed_path) - len(extension)]
+            else:
+                self.move_local_path(indexed_path, local_path)
+
+        if file_metadata['mimeType'] == FOLDER_TYPE:
+            if not os.path.exists(file_path):
+                with self.metrics.measure("filesystem.mkdir"):
+                    os.mkdir(file_path)
+                self.events_manager.update("create", file_metadata['name'], path)
+            self.index.put(file_id, file_path, file_metadata)
+        else:
+            self.export_and_download_file(file_id, file_metadata['mimeType'], file_path, file_metadata)
+
+    def move_local_path(self, old_path, new_path):
+        """
+        Move or rename a local file or folder and update the index entries under it.
+        :param old_path: current local path.
+        :param new_path: new local path.
+        :return: None.
+        """
+        self.downloads.wait_for(old_path)
+        if not os.path.exists(old_path) or os.path.exists(new_path):
+            return
+
+        with self.metrics.measure("filesystem.move"):
+            os.replace(old_path, new_path)
+        self.index.move_tree(old_path, new_path)
+        self.events_manager.update("move", os.path.basename(old_path), os.path.dirname(old_path), new_path)
 
     def event_factory(self, action, activity, file_metadata, path):
         """
@@ -428,7 +1493,7 @@ class GoogleDriveClient:
 
     def rename_event(self, activity, file_metadata, path):
         """
-        Rename a file or folder.
+        Rename a file or folder, a folder is renamed with its whole subtree in one local operation.
         :param activity: Google Drive Activity object.
         :param file_metadata: file metadata.
         :param path: path to the file.
@@ -436,61 +1501,173 @@ class GoogleDriveClient:
         """
         file_metadata['oldTitle'] = activity['primaryActionDetail']['rename']['oldTitle']
         file_metadata['newTitle'] = activity['primaryActionDetail']['rename']['newTitle']
-
-        old_path = os.path.join(path, file_metadata['oldTitle'])
-        new_path = os.path.join(path, file_metadata['newTitle'])
+        extension = EXTENSIONS.get(file_metadata['mimeType'], "")
+
+        file_id = file_metadata['id']
+        old_title_path = os.path.join(path, file_metadata['oldTitle'] + extension)
+        self.downloads.wait_for(old_title_path)
+        indexed_path = self.index.get_path(file_id)
+        if indexed_path is not None:
+            self.downloads.wait_for(indexed_path)
+        old_path = self.index.get_path(file_id) or old_title_path
+        new_path = os.path.join(os.path.dirname(old_path), file_metadata['newTitle'] + extension)
+        if old_path == new_path:
+            # an edit downloaded the file under its new name, the copy under the old name may be left
+            old_path = os.path.join(os.path.dirname(new_path), file_metadata['oldTitle'] + extension)
+            if old_path == new_path:
+                return
+        self.downloads.wait_for(old_path)
+        self.downloads.wait_for(new_path)
+        # an edit downloaded in this sync is already under the new name, the old copy is stale
+        indexed_path = self.index.get_path(file_id)
         old_path_exists = os.path.exists(old_path)
         new_path_exists = os.path.exists(new_path)
+        new_entry = self.index.find(new_path)
+        new_path_is_other_file = new_entry is not None and new_entry['file_id'] != file_id
+
+        if indexed_path == new_path:
+            if self.remove_stale_copy(old_path, new_path):
+                self.events_manager.update("rename", file_metadata['oldTitle'], os.path.dirname(new_path),
+                                           file_metadata['newTitle'])
+        elif old_path_exists and not new_path_exists:
+            with self.metrics.measure("filesystem.rename"):
+                os.replace(old_path, new_path)
+            if indexed_path is not None:
+                self.index.move_tree(old_path, new_path)
+            else:
+                self.index.put(file_id, new_path, file_metadata)
+            self.events_manager.update("rename", file_metadata['oldTitle'], os.path.dirname(new_path),
+                                       file_metadata['newTitle'])
+        elif old_path_exists and new_path_is_other_file:
+            # Drive allows siblings with the same name, the local copy keeps its old name
+            print(f"not renaming {old_path}, {new_path} is another Drive file")
+        elif old_path_exists and os.path.isdir(old_path) and os.path.isdir(new_path):
+            # content created in the folder was already synced under its new name
+            self.merge_folders(old_path, new_path)
+            self.index.put(file_id, new_path, file_metadata)
+        elif new_path_exists and indexed_path is None and not new_path_is_other_file:
+            self.index.put(file_id, new_path, file_metadata)
 
-        if old_path_exists == new_path_exists:
-            return
+        if file_metadata['mimeType'] == FOLDER_TYPE:
+            self.folder_cache.put_metadata(file_metadata)
 
-        if old_path_exists and not new_path_exists:
-            os.rename(old_path, new_path)
+    def remove_stale_copy(self, stale_path, path):
+        """
+        Remove the copy left at the old path of a file an edit already downloaded at its new path.
+        The copy of a folder is merged into the folder, a path indexed for another file is kept.
+        :param stale_path: old local path.
+        :param path: local path of the file.
+        :return: True if a copy was removed, False otherwise.
+        """
+        if not os.path.exists(stale_path) or self.index.find(stale_path) is not None:
+            return False
+        if os.path.isdir(stale_path):
+            self.merge_folders(stale_path, path)
+        else:
+            with self.metrics.measure("filesystem.delete"):
+                os.remove(stale_path)
+        return True
 
-            shortened_file_path = "\\".join(new_path.split("\\")[-4:-1])
-            self.events_manager.update("rename",
-                                       f"<html><br><p style='color:{events_colors['rename']}'>"
-                                       f"<b>Renamed {file_metadata['oldTitle']}</b> to"
-                                       f" <b>{file_metadata['newTitle']}</b> in {shortened_file_path}.</p></html>")
-        elif old_path_exists and new_path_exists:
-            shutil.rmtree(old_path)
+    def merge_folders(self, old_path, new_path):
+        """
+        Move the content of a stale copy of a folder into the folder, then remove the copy if it is empty.
+        Files present in both are kept in the folder, they were synced after the ones in the copy.
+        :param old_path: stale copy of the folder.
+        :param new_path: folder.
+        :return: None.
+        """
+        for name in os.listdir(old_path):
+            source = os.path.join(old_path, name)
+            target = os.path.join(new_path, name)
+            if not os.path.exists(target):
+                with self.metrics.measure("filesystem.move"):
+                    os.replace(source, target)
+                self.index.move_tree(source, target)
+            elif os.path.isdir(source) and os.path.isdir(target):
+                self.merge_folders(source, target)
+        if not os.listdir(old_path):
+            with self.metrics.measure("filesystem.delete"):
+                os.rmdir(old_path)
+
+    def indexed_parent_path(self, file_metadata):
+        """
+        Get the local path of the parent folder of a file from the index.
+        :param file_metadata: file metadata.
+        :return: local path of the parent folder, or None if it is not indexed.
+        """
+        parents = file_metadata.get('parents')
+        if not parents:
+            return None
+        if parents[0] == self.drive_id:
+            return self.local_directory
+        path = self.index.get_path(parents[0])
+        return path if path is not None and os.path.isdir(path) else None
+
+    def folder_local_path(self, folder_id):
+        """
+        Get the local path of a Drive folder from the index, or from the folder cache if it is not indexed.
+        :param folder_id: folder ID.
+        :return: local path or None.
+        """
+        if folder_id == self.drive_id:
+            return self.local_directory
+        path = self.index.get_path(folder_id)
+        if path is not None:
+            return path
+        folder = self.get_folder(folder_id)
+        directory = self.build_file_path(folder_id)
+        if folder is None or directory is None:
+            return None
+        return os.path.join(*directory, folder[0])
 
     def move_event(self, activity, file_metadata):
         """
-        Move a file or folder.
+        Move a file or folder, both ends are resolved from the index so a folder is moved with its whole subtree
+        in one local operation, without walking its ancestors on Drive.
         :param activity: Google Drive Activity object.
         :param file_metadata: file metadata.
         :return: None.
         """
-        try:
-            move_action = activity['primaryActionDetail']['move']
-            removed_parent = move_action['removedParents'][0]['driveItem']
-            removed_parent_id = removed_parent['name'].split('/')[1]
-            if removed_parent_id != self.drive_id:
-                old_path = os.path.join(*self.build_file_path(removed_parent_id), removed_parent['title'])
-            else:
-                old_path = self.local_directory
-
-            if old_path is None:
-                return
-
-            old_path = os.path.join(str(old_path), file_metadata['name'])
-
-            added_parent = move_action['addedParents'][0]['driveItem']
-            added_parent_id = added_parent['name'].split('/')[1]
-            new_path = os.path.join(*self.build_file_path(added_parent_id), added_parent['title'])
+        move_action = activity['primaryActionDetail']['move']
+        removed_path = None
+        if move_action.get('removedParents'):
+            removed_parent_id = self.get_item_id(move_action['removedParents'][0]['driveItem'])
+            parent_path = self.folder_local_path(removed_parent_id)
+            if parent_path is not None:
+                removed_path = os.path.join(parent_path,
+                                            file_metadata['name'] + EXTENSIONS.get(file_metadata['mimeType'], ""))
+                self.downloads.wait_for(removed_path)
+        indexed_path = self.index.get_path(file_metadata['id'])
+        if indexed_path is not None:
+            self.downloads.wait_for(indexed_path)
+        old_path = self.index.get_path(file_metadata['id']) or removed_path
+        if old_path is None:
+            return
 
-            if not os.path.exists(os.path.join(str(new_path), file_metadata['name'])) and os.path.exists(str(old_path)):
-                shutil.move(str(old_path), str(new_path))
-                shortened_old_path = "\\".join(old_path.split("\\")[-4:-1])
-                shortened_new_path = "\\".join(new_path.split("\\")[-4:-1])
-                self.events_manager.update("move",
-                                           f"<html><br><p style='color:{events_colors['move']}'>"
-                                           f"<b>Moved {file_metadata['name']}</b> from"
-                                           f" {shortened_old_path} to {shortened_new_path}.</p></html>")
-        except Exception as e:
-            print(e)
+        new_parent_path = None
+        added_parent_id = None
+        if move_action.get('addedParents'):
+            added_parent_id = self.get_item_id(move_action['addedParents'][0]['driveItem'])
+            new_parent_path = self.folder_local_path(added_parent_id)
+        if new_parent_path is None:
+            new_parent_path = os.path.join(*file_metadata['directory'])
+
+        new_path = os.path.join(new_parent_path, os.path.basename(old_path))
+        self.downloads.wait_for(new_path)
+        if self.index.get_path(file_metadata['id']) == new_path:
+            # an edit downloaded the file in its new folder, the copy in the old folder may be left
+            stale_path = removed_path if old_path == new_path else old_path
+            if stale_path not in (None, new_path) and self.remove_stale_copy(stale_path, new_path):
+                self.events_manager.update("move", os.path.basename(stale_path), os.path.dirname(stale_path),
+                                           new_path)
+            return
+        try:
+            self.move_local_path(old_path, new_path)
+        except OSError as error:
+            print('An error occurred: {}'.format(error))
+            return
+        if file_metadata['mimeType'] == FOLDER_TYPE and added_parent_id is not None:
+            self.folder_cache.put(file_metadata['id'], file_metadata['name'], added_parent_id)
 
     def delete_event(self, file_metadata, path):
         """
@@ -499,21 +1676,22 @@ class GoogleDriveClient:
         :param path: path to the file.
         :return: None.
         """
-        file_path = os.path.join(path, file_metadata['name'])
+        file_path = self.index.get_path(file_metadata['id']) or os.path.join(
+            path, file_metadata['name'] + EXTENSIONS.get(file_metadata['mimeType'], ""))
+        self.folder_cache.invalidate(file_metadata['id'])
+        self.downloads.wait_for(file_path)
 
         if os.path.exists(file_path):
-            shortened_file_path = "\\".join(file_path.split("\\")[-4:-1])
             if file_metadata['mimeType'] == FOLDER_TYPE:
-                shutil.rmtree(file_path)
-                self.events_manager.update("delete",
-                                           f"<html><br><p style='color:{events_colors['delete']}'>"
-                                           f"<b>Deleted</b> {file_metadata['name']}"
-                                           f" folder in {shortened_file_path}.</p></html>")
+                with self.metrics.measure("filesystem.delete"):
+                    shutil.rmtree(file_path)
+                self.index.remove_tree(file_path)
+                self.events_manager.update("delete_folder", file_metadata['name'], os.path.dirname(file_path))
             else:
-                os.remove(file_path)
-                self.events_manager.update("delete", f"<html><br><p style='color:{events_colors['delete']}'>"
-                                                     f"<b>Deleted {file_metadata['name']}</b>"
-                                                     f" in {shortened_file_path}.</p></html>")
+                with self.metrics.measure("filesystem.delete"):
+                    os.remove(file_path)
+                self.index.remove_tree(file_path)
+                self.events_manager.update("delete", file_metadata['name'], os.path.dirname(file_path))
 
     def create_event(self, file_metadata, path):
         """
@@ -523,16 +1701,16 @@ class GoogleDriveClient:
         :return:
         """
         file_path = os.path.join(path, file_metadata['name'])
-        file_path_exists = os.path.exists(file_path)
+        local_path = file_path + EXTENSIONS.get(file_metadata['mimeType'], "")
+        file_path_exists = os.path.exists(local_path) or self.downloads.is_pending(local_path)
 
         if file_metadata['mimeType'] != FOLDER_TYPE and not file_path_exists:
-            self.export_and_download_file(file_metadata['id'], file_metadata['mimeType'], file_path)
+            self.export_and_download_file(file_metadata['id'], file_metadata['mimeType'], file_path, file_metadata)
         elif file_metadata['mimeType'] == FOLDER_TYPE and not file_path_exists:
-            os.mkdir(file_path)
-            shortened_file_path = "\\".join(file_path.split("\\")[-4:-1])
-            self.events_manager.update("create", f"<html><br><p style='color:{events_colors['create']}'>"
-                                                 f"<b>Created {file_metadata['name']}</b>"
-                                                 f" folder in {shortened_file_path}.</p></html>")
+            with self.metrics.measure("filesystem.mkdir"):
+                os.mkdir(file_path)
+            self.index.put(file_metadata['id'], file_path, file_metadata)
+            self.events_manager.update("create", file_metadata['name'], path)
 
     def edit_event(self, file_metadata, path):
         """
@@ -544,11 +1722,8 @@ class GoogleDriveClient:
         file_path = os.path.join(path, file_metadata['name'])
 
         if file_metadata['mimeType'] != FOLDER_TYPE:
-            shortened_file_path = "\\".join(file_path.split("\\")[-4:-1])
-            self.export_and_download_file(file_metadata['id'], file_metadata['mimeType'], file_path)
-            self.events_manager.update("update", f"<html><br><p style='color:{events_colors['update']}'>"
-                                                 f"<b>Updated {file_metadata['name']}</b>"
-                                                 f" in {shortened_file_path}.</p></html>")
+            self.export_and_download_file(file_metadata['id'], file_metadata['mimeType'], file_path, file_metadata)
+            self.events_manager.update("update", file_metadata['name'], path)
 
     def restore_event(self, file_metadata, path):
         """
@@ -560,14 +1735,10 @@ class GoogleDriveClient:
         file_path = os.path.join(path, file_metadata['name'])
 
         if file_metadata['mimeType'] == FOLDER_TYPE:
-            os.mkdir(file_path)
-            shortened_file_path = "\\".join(file_path.split("\\")[-4:-1])
-            self.events_manager.update("restore", f"<html><br><p style='color:{events_colors['restore']}'>"
-                                                  f"<b>Restored {file_metadata['name']}</b>"
-                                                  f" folder in {shortened_file_path}.</p></html>")
+            with self.metrics.measure("filesystem.mkdir"):
+                os.mkdir(file_path)
+            self.index.put(file_metadata['id'], file_path, file_metadata)
+            self.events_manager.update("restore_folder", file_metadata['name'], path)
         else:
-            self.export_and_download_file(file_metadata['id'], file_metadata['mimeType'], file_path)
-            shortened_file_path = "\\".join(file_path.split("\\")[-4:-1])
-            self.events_manager.update("restore", f"<html><br><p style='color:{events_colors['restore']}'>"
-                                                  f"<b>Restored {file_metadata['name']}</b>"
-                                                  f" in {shortened_file_path}.</p></html>")
+            self.export_and_download_file(file_metadata['id'], file_metadata['mimeType'], file_path, file_metadata)
+            self.events_manager.update("restore", file_metadata['name'], path)
@@ -1,10 +1,163 @@
+import re
+import threading
+import time
+from collections import deque
+
+MESSAGES = {
+    "start": "Syncing...",
+    "no_changes": "No changes to sync.",
+    "plan": "{detail}",
+    "skip_type": "Skipped {name} because of its type {detail}.",
+    "skip_unchanged": "Skipped {name}, it is already up to date.",
+    "skip_filter": "Skipped {name}, it is excluded by the filters.",
+    "download": "Start Downloading {name}.",
+    "resume": "Resume Downloading {name} from byte {detail}.",
+    "progress": "Downloading {name} {progress}%.",
+    "done": "Done downloading {name} to {path}.",
+    "dedupe": "Copied {name} to {path} from an identical local file ({detail}).",
+    "create": "Created {name} folder in {path}.",
+    "update": "Updated {name} in {path}.",
+    "restore": "Restored {name} in {path}.",
+    "restore_folder": "Restored {name} folder in {path}.",
+    "rename": "Renamed {name} to {target} in {path}.",
+    "move": "Moved {name} from {path} to {target}.",
+    "delete": "Deleted {name} in {path}.",
+    "delete_folder": "Deleted {name} folder in {path}.",
+    "sync_done": "Syncing done. {detail}",
+    "upload": "Uploaded {name} from {path}.",
+    "upload_folder": "Created {name} folder in Drive from {path}.",
+    "upload_move": "Moved {name} in Drive to {target}.",
+    "upload_delete": "Trashed {name} in Drive, it was deleted from {path}.",
+}
+
+
+class SyncEvent:
+    __slots__ = ("kind", "name", "path", "target", "detail", "progress", "timestamp")
+
+    def __init__(self, kind, name="", path="", target="", detail="", progress=None):
+        """
+        Structured sync event, rendered by the subscribers.
+        :param kind: event kind, one of the MESSAGES keys.
+        :param name: name of the file or folder.
+        :param path: local path the event happened in.
+        :param target: new name or path of a rename or move.
+        :param detail: free text detail.
+        :param progress: download progress in percent.
+        """
+        self.kind = kind
+        self.name = name
+        self.path = path
+        self.target = target
+        self.detail = detail
+        self.progress = progress
+        self.timestamp = time.time()
+
+    def describe(self):
+        """
+        Describe the event in plain text, paths are shortened to their last 3 directories.
+        :return: text.
+        """
+        return MESSAGES[self.kind].format(name=self.name, path=shorten_path(self.path),
+                                          target=shorten_path(self.target), detail=self.detail,
+                                          progress=self.progress)
+
+
+def shorten_path(path):
+    """
+    Take the last 3 directories of a path.
+    :param path: local path.
+    :return: shortened path.
+    """
+    return "\\".join([part for part in re.split(r"[\\/]", path) if part][-3:]) if path else path
+
+
 class EventsManager:
-    def __init__(self):
-        self.gui_client = None
+    def __init__(self, frame_rate=10, max_events=1000):
+        """
+        Buffered event bus between the sync and its subscribers.
+        Events are delivered in batches at a fixed frame rate, download progress is coalesced per file
+        and only the last max_events events are retained, delivered or not, e.g. when no flusher is started.
+        :param frame_rate: number of flushes per second.
+        :param max_events: size of the retained event log and of the pending events.
+        """
+        self.subscribers = []
+        self.frame_interval = 1 / frame_rate
+        self.max_events = max_events
+        self.history = deque(maxlen=max_events)
+        self.lock = threading.Lock()
+        self.pending_events = deque(maxlen=max_events)
+        self.pending_progress = {}
+        self.flusher = None
+        self.stop_flushing = threading.Event()
+
+    def subscribe(self, subscriber):
+        """
+        Subscribe to the events.
+        :param subscriber: function called with each batch of SyncEvent objects.
+        :return: None.
+        """
+        self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    def update(self, kind, name="", path="", target="", detail="", progress=None):
+        """
+        Publish an event, it can be called from any thread.
+        :return: None.
+        """
+        event = SyncEvent(kind, name, path, target, detail, progress)
+        with self.lock:
+            if kind == "progress":
+                self.pending_progress.pop(name, None)
+                self.pending_progress[name] = event
+                if len(self.pending_progress) > self.max_events:
+                    # drop the progress of the file that went quiet the longest ago
+                    self.pending_progress.pop(next(iter(self.pending_progress)))
+                return
+            if kind == "done":
+                self.pending_progress.pop(name, None)
+            self.pending_events.append(event)
+
+    def flush(self):
+        """
+        Deliver the pending events to the subscribers in one batch.
+        :return: None.
+        """
+        with self.lock:
+            events = list(self.pending_events) + list(self.pending_progress.values())
+            self.pending_events.clear()
+            self.pending_progress = {}
+        if not events:
+            return
+
+        self.history.extend(events)
+        for subscriber in list(self.subscribers):
+            subscriber(events)
+
+    def start(self):
+        """
+        Start flushing at the frame rate on a background thread.
+        :return: None.
+        """
+        if self.flusher is not None:
+            return
+        self.stop_flushing.clear()
+        self.flusher = threading.Thread(target=self.flush_periodically, name="events", daemon=True)
+        self.flusher.start()
 
-    def set_gui_client(self, gui_client):
-        self.gui_client = gui_client
+    def stop(self):
+        """
+        Stop the background flushing and deliver the remaining events.
+        :return: None.
+        """
+        if self.flusher is not None:
+            self.stop_flushing.set()
+            self.flusher.join()
+            self.flusher = None
+        self.flush()
 
-    def update(self, event, text):
-        if self.gui_client is not None:
-            self.gui_client.notify(event, text)
+    def flush_periodically(self):
+        while not self.stop_flushing.wait(self.frame_interval):
+            self.flush()
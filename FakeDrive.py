@@ -0,0 +1,494 @@
+import datetime
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+from googleapiclient.errors import HttpError
+
+FOLDER_TYPE = "application/vnd.google-apps.folder"
+DOCUMENT_TYPE = "application/vnd.google-apps.document"
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+class FakeResponse(dict):
+    def __init__(self, status, headers=None):
+        """
+        httplib2-like response, a dict of headers with a status.
+        :param status: HTTP status.
+        :param headers: response headers.
+        """
+        super(FakeResponse, self).__init__(headers or {})
+        self.status = status
+        self.reason = "OK" if status < 400 else "Error"
+
+
+class FakeRequest:
+    def __init__(self, drive, method, function):
+        """
+        Request returned by the fake services, executing it counts one API call.
+        :param drive: FakeDrive.
+        :param method: API method name, used for the call counters.
+        :param function: function computing the response.
+        """
+        self.drive = drive
+        self.method = method
+        self.function = function
+
+    def execute(self, http=None, num_retries=0):
+        self.drive.count_call(self.method)
+        error = self.drive.injected_error()
+        if error is not None:
+            raise HttpError(FakeResponse(error[0]), error[1], uri=self.method)
+        return self.function()
+
+
+class FakeUploadRequest(FakeRequest):
+    def __init__(self, drive, method, function, media_body=None):
+        """
+        Create or update request, with the content of the file if it has a media body.
+        :param drive: FakeDrive.
+        :param method: API method name, used for the call counters.
+        :param function: function computing the response from the uploaded content.
+        :param media_body: MediaUpload with the content, or None for a metadata update.
+        """
+        super(FakeUploadRequest, self).__init__(drive, method, self.upload)
+        self.upload_function = function
+        self.media_body = media_body
+        self.http = None
+
+    def upload(self):
+        content = None
+        if self.media_body is not None:
+            content = self.media_body.getbytes(0, self.media_body.size())
+        return self.upload_function(content)
+
+    def next_chunk(self, http=None, num_retries=0):
+        # the whole content is sent in one chunk
+        return None, self.execute()
+
+
+class FakeMediaRequest:
+    def __init__(self, drive, file_id, export_mime_type=None):
+        """
+        Media request accepted by MediaIoBaseDownload, the chunks are served by the FakeHttp of the drive.
+        :param drive: FakeDrive.
+        :param file_id: file ID.
+        :param export_mime_type: MIME type of an export, None for a binary download.
+        """
+        self.drive = drive
+        self.uri = f"fake://files/{file_id}" + (f"?export={export_mime_type}" if export_mime_type else "")
+        self.headers = {}
+        self.http = drive.http
+
+
+class FakeHttp:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        """
+        Serve a range of a fake file.
+        :return: response and content.
+        """
+        self.drive.count_call("media")
+        error = self.drive.injected_error()
+        if error is not None:
+            return FakeResponse(error[0]), error[1]
+        file_id = uri[len("fake://files/"):].split("?")[0]
+        content = self.drive.get_content(file_id)
+        if content is None:
+            return FakeResponse(404), b'{"error": {"message": "File not found"}}'
+
+        match = re.match(r"bytes=(\d+)-(\d+)", (headers or {}).get("range", ""))
+        if match is None or len(content) == 0:
+            self.drive.count_bytes(len(content))
+            return FakeResponse(200, {"content-length": str(len(content))}), content
+
+        start, end = int(match.group(1)), min(int(match.group(2)), len(content) - 1)
+        chunk = content[start:end + 1]
+        self.drive.count_bytes(len(chunk))
+        return FakeResponse(206, {"content-range": f"bytes {start}-{end}/{len(content)}"}), chunk
+
+
+class FakeBatch:
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self, http=None):
+        # one HTTP round trip for the whole batch
+        self.drive.count_call("batch")
+        for request_id, request in self.requests:
+            error = self.drive.injected_error()
+            try:
+                if error is not None:
+                    raise HttpError(FakeResponse(error[0]), error[1], uri=request.method)
+                response, exception = request.function(), None
+            except HttpError as error:
+                response, exception = None, error
+            self.callback(request_id, response, exception)
+
+
+class FakeFiles:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def get(self, fileId, fields=None, **kwargs):
+        return FakeRequest(self.drive, "files.get", lambda: self.drive.get_metadata(fileId))
+
+    def list(self, q="", fields=None, pageSize=100, pageToken=None, **kwargs):
+        return FakeRequest(self.drive, "files.list", lambda: self.drive.list_children(q, pageSize, pageToken))
+
+    def create(self, body, media_body=None, fields=None, **kwargs):
+        return FakeUploadRequest(self.drive, "files.create",
+                                 lambda content: self.drive.upload(None, body, content), media_body)
+
+    def update(self, fileId, body=None, media_body=None, addParents=None, removeParents=None, fields=None,
+               **kwargs):
+        return FakeUploadRequest(self.drive, "files.update",
+                                 lambda content: self.drive.upload(fileId, body or {}, content, addParents,
+                                                                   removeParents), media_body)
+
+    def get_media(self, fileId, **kwargs):
+        return FakeMediaRequest(self.drive, fileId)
+
+    def export_media(self, fileId, mimeType, **kwargs):
+        return FakeMediaRequest(self.drive, fileId, mimeType)
+
+
+class FakeChanges:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def getStartPageToken(self, **kwargs):
+        return FakeRequest(self.drive, "changes.getStartPageToken",
+                           lambda: {"startPageToken": str(len(self.drive.changes_log))})
+
+    def list(self, pageToken, pageSize=100, **kwargs):
+        return FakeRequest(self.drive, "changes.list", lambda: self.drive.list_changes(pageToken, pageSize))
+
+
+class FakeDriveService:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def files(self):
+        return FakeFiles(self.drive)
+
+    def changes(self):
+        return FakeChanges(self.drive)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self.drive, callback)
+
+
+class FakeActivity:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def query(self, body):
+        return FakeRequest(self.drive, "activity.query", lambda: self.drive.query_activities(body))
+
+
+class FakeActivityService:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def activity(self):
+        return FakeActivity(self.drive)
+
+
+class FakeDrive:
+    def __init__(self, latency=0.0, root_name="Sync Root", error_rate=0.0, seed=0):
+        """
+        In-memory fake of the Drive v3 and Drive Activity v2 APIs, for offline benchmarks.
+        Every mutation records the activity and the change the real APIs would report.
+        :param latency: seconds slept for each API call or media chunk.
+        :param root_name: name of the synced folder.
+        :param error_rate: fraction of the calls failing with a quota error (429 or 403 rateLimitExceeded).
+        :param seed: seed of the injected errors.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.errors_injected = 0
+        self.lock = threading.RLock()
+        self.files = {}
+        self.contents = {}
+        self.activities = []
+        self.changes_log = []
+        self.calls = Counter()
+        self.bytes_served = 0
+        self.clock = datetime.datetime(2024, 1, 1)
+        self.next_id = 0
+        self.drive_service = FakeDriveService(self)
+        self.activity_service = FakeActivityService(self)
+        self.http = FakeHttp(self)
+
+        my_drive = self.add_file("My Drive", FOLDER_TYPE, None, record=False)
+        self.root_id = self.add_file(root_name, FOLDER_TYPE, my_drive, record=False)
+
+    def count_call(self, method):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls[method] += 1
+
+    def injected_error(self):
+        """
+        Draw whether the current call fails with a quota error.
+        :return: (status, content) of the error, or None.
+        """
+        with self.lock:
+            if not self.error_rate or self.random.random() >= self.error_rate:
+                return None
+            self.errors_injected += 1
+            if self.random.random() < 0.5:
+                return 429, b'{"error": {"message": "Too many requests", "errors": [{"reason": "rateLimitExceeded"}]}}'
+            return 403, (b'{"error": {"message": "User rate limit exceeded",'
+                         b' "errors": [{"reason": "userRateLimitExceeded"}]}}')
+
+    def count_bytes(self, size):
+        with self.lock:
+            self.bytes_served += size
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls = Counter()
+            self.bytes_served = 0
+            self.errors_injected = 0
+
+    def now(self):
+        return self.clock.strftime(TIMESTAMP_FORMAT)
+
+    def tick(self):
+        self.clock += datetime.timedelta(seconds=1)
+        return self.now()
+
+    def add_file(self, name, mime_type, parent_id, size=0, record=True):
+        """
+        Create a file or folder.
+        :param name: name.
+        :param mime_type: MIME type.
+        :param parent_id: parent folder ID.
+        :param size: size in bytes of a binary file.
+        :param record: record a create activity and change.
+        :return: file ID.
+        """
+        with self.lock:
+            self.next_id += 1
+            file_id = f"file{self.next_id}"
+            timestamp = self.tick()
+            self.files[file_id] = {
+                "id": file_id,
+                "name": name,
+                "mimeType": mime_type,
+                "parents": [parent_id] if parent_id else [],
+                "trashed": False,
+                "createdTime": timestamp,
+                "modifiedTime": timestamp,
+                "version": "1",
+                "webViewLink": f"https://drive.google.com/file/d/{file_id}/view",
+            }
+            if mime_type != FOLDER_TYPE and not mime_type.startswith("application/vnd.google-apps."):
+                self.set_content(file_id, size)
+            if record:
+                self.record(file_id, "create", {"new": {}}, timestamp)
+            return file_id
+
+    def create_folder(self, name, parent_id):
+        return self.add_file(name, FOLDER_TYPE, parent_id)
+
+    def create_file(self, name, parent_id, size=1024, mime_type="application/octet-stream"):
+        return self.add_file(name, mime_type, parent_id, size)
+
+    def build_tree(self, depth=3, folders_per_level=2, files_per_folder=3, file_size=1024):
+        """
+        Build a tree of folders under the root, with files in every folder.
+        :return: folder IDs and file IDs.
+        """
+        folders, files = [], []
+        level = [self.root_id]
+        for depth_index in range(depth):
+            next_level = []
+            for parent_id in level:
+                for folder_index in range(folders_per_level):
+                    next_level.append(self.create_folder(f"folder {depth_index}-{folder_index}", parent_id))
+            folders.extend(next_level)
+            level = next_level
+        for folder_id in [self.root_id] + folders:
+            for file_index in range(files_per_folder):
+                files.append(self.create_file(f"file {file_index}.bin", folder_id, file_size))
+        return folders, files
+
+    def copy(self, file_id, name, parent_id):
+        """
+        Create a file with the same content as another file, like files.copy.
+        :return: file ID of the copy.
+        """
+        with self.lock:
+            metadata = self.files[file_id]
+            copy_id = self.add_file(name, metadata["mimeType"], parent_id, record=False)
+            if file_id in self.contents:
+                self.contents[copy_id] = self.contents[file_id]
+                self.files[copy_id]["size"] = metadata["size"]
+                self.files[copy_id]["md5Checksum"] = metadata["md5Checksum"]
+            self.record(copy_id, "create", {"new": {}}, self.files[copy_id]["createdTime"])
+            return copy_id
+
+    def edit(self, file_id):
+        with self.lock:
+            metadata = self.files[file_id]
+            timestamp = self.tick()
+            metadata["modifiedTime"] = timestamp
+            metadata["version"] = str(int(metadata["version"]) + 1)
+            if file_id in self.contents:
+                self.set_content(file_id, len(self.contents[file_id]))
+            self.record(file_id, "edit", {}, timestamp)
+
+    def rename(self, file_id, new_name):
+        with self.lock:
+            metadata = self.files[file_id]
+            old_name, metadata["name"] = metadata["name"], new_name
+            self.record(file_id, "rename", {"oldTitle": old_name, "newTitle": new_name}, self.tick())
+
+    def move(self, file_id, new_parent_id):
+        with self.lock:
+            metadata = self.files[file_id]
+            old_parent_id = metadata["parents"][0]
+            metadata["parents"] = [new_parent_id]
+            self.record(file_id, "move", {"addedParents": [{"driveItem": self.drive_item(new_parent_id)}],
+                                          "removedParents": [{"driveItem": self.drive_item(old_parent_id)}]},
+                        self.tick())
+
+    def delete(self, file_id):
+        with self.lock:
+            self.files[file_id]["trashed"] = True
+            self.record(file_id, "delete", {"type": "TRASH"}, self.tick())
+
+    def set_content(self, file_id, size):
+        version = self.files[file_id]["version"]
+        pattern = f"{file_id}:{version};".encode()
+        content = (pattern * (size // len(pattern) + 1))[:size]
+        self.contents[file_id] = content
+        self.files[file_id]["size"] = str(size)
+        self.files[file_id]["md5Checksum"] = hashlib.md5(content).hexdigest()
+        self.files[file_id]["headRevisionId"] = f"{file_id}-{version}"
+
+    def upload(self, file_id, body, content=None, add_parent=None, remove_parent=None):
+        """
+        Apply a files.create or files.update request, recording the activities of the changes.
+        :param file_id: updated file ID, None to create a file.
+        :param body: metadata of the request: name, mimeType, parents or trashed.
+        :param content: uploaded content, None if only the metadata changes.
+        :param add_parent: new parent of a moved file.
+        :param remove_parent: old parent of a moved file.
+        :return: metadata of the file.
+        """
+        with self.lock:
+            if file_id is None:
+                parents = body.get("parents") or [self.root_id]
+                file_id = self.add_file(body["name"], body.get("mimeType", "application/octet-stream"), parents[0])
+            elif file_id not in self.files:
+                raise self.not_found(file_id)
+            else:
+                metadata = self.files[file_id]
+                if body.get("name", metadata["name"]) != metadata["name"]:
+                    self.rename(file_id, body["name"])
+                if add_parent and add_parent not in metadata["parents"]:
+                    self.move(file_id, add_parent)
+                if body.get("trashed"):
+                    self.delete(file_id)
+                if content is not None:
+                    self.edit(file_id)
+
+            if content is not None and file_id in self.contents:
+                self.contents[file_id] = content
+                self.files[file_id]["size"] = str(len(content))
+                self.files[file_id]["md5Checksum"] = hashlib.md5(content).hexdigest()
+            return json.loads(json.dumps(self.files[file_id]))
+
+    def get_content(self, file_id):
+        with self.lock:
+            if file_id in self.contents:
+                return self.contents[file_id]
+            if file_id in self.files:
+                metadata = self.files[file_id]
+                return f"{metadata['name']} version {metadata['version']}".encode()
+        return None
+
+    def drive_item(self, file_id):
+        return {"name": f"items/{file_id}", "title": self.files[file_id]["name"]}
+
+    def record(self, file_id, action, detail, timestamp):
+        self.activities.append({
+            "primaryActionDetail": {action: detail},
+            "targets": [{"driveItem": self.drive_item(file_id)}],
+            "timestamp": timestamp,
+        })
+        self.changes_log.append((file_id, timestamp))
+
+    def not_found(self, file_id):
+        return HttpError(FakeResponse(404), json.dumps({"error": {"message": f"File not found: {file_id}"}}).encode(),
+                         uri=f"fake://files/{file_id}")
+
+    def get_metadata(self, file_id):
+        with self.lock:
+            if file_id not in self.files:
+                raise self.not_found(file_id)
+            return json.loads(json.dumps(self.files[file_id]))
+
+    def list_children(self, q, page_size, page_token):
+        folder_ids = set(re.findall(r"'([^']+)' in parents", q))
+        with self.lock:
+            children = [json.loads(json.dumps(metadata)) for metadata in self.files.values()
+                        if folder_ids.intersection(metadata["parents"]) and not metadata["trashed"]]
+        start = int(page_token or 0)
+        response = {"files": children[start:start + page_size]}
+        if start + page_size < len(children):
+            response["nextPageToken"] = str(start + page_size)
+        return response
+
+    def list_changes(self, page_token, page_size):
+        start, _, offset = page_token.partition(":")
+        with self.lock:
+            # like the real feed, a file changed several times is only listed at its last change
+            last_changes = {}
+            for file_id, timestamp in self.changes_log[int(start):]:
+                last_changes.pop(file_id, None)
+                last_changes[file_id] = timestamp
+            changes = [{"fileId": file_id, "removed": False, "time": timestamp,
+                        "file": json.loads(json.dumps(self.files[file_id]))}
+                       for file_id, timestamp in last_changes.items()]
+            end_token = str(len(self.changes_log))
+
+        offset = int(offset or 0)
+        response = {"changes": changes[offset:offset + page_size]}
+        if offset + page_size < len(changes):
+            response["nextPageToken"] = f"{start}:{offset + page_size}"
+        else:
+            response["newStartPageToken"] = end_token
+        return response
+
+    def query_activities(self, body):
+        since = re.search(r'time >= "([^"]+)"', body.get("filter", "")).group(1)
+        since = datetime.datetime.strptime(since, TIMESTAMP_FORMAT if "." in since else "%Y-%m-%dT%H:%M:%SZ")
+        with self.lock:
+            # the real API returns the newest activities first
+            activities = [activity for activity in reversed(self.activities)
+                          if datetime.datetime.strptime(activity["timestamp"], TIMESTAMP_FORMAT) >= since]
+
+        page_size = body.get("pageSize", 100)
+        start = int(body.get("pageToken", 0))
+        response = {"activities": activities[start:start + page_size]}
+        if start + page_size < len(activities):
+            response["nextPageToken"] = str(start + page_size)
+        return response
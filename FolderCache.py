@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+
+
+class FolderCache:
+    def __init__(self, cache_file=None):
+        """
+        Folder ancestry cache mapping a Drive folder ID to its (name, parent ID).
+        The sync thread and the upload thread both update it, entries are replaced whole so reads need no lock.
+        :param cache_file: optional JSON file to keep the cache between runs.
+        """
+        self.cache_file = cache_file
+        self.folders = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """
+        Load the cache from its file if it exists.
+        :return: None.
+        """
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as error:
+            print('Could not read the folder cache: {}'.format(error))
+            return
+        with self.lock:
+            self.folders = {folder_id: tuple(entry) for folder_id, entry in data.items()}
+
+    def save(self):
+        """
+        Save the cache to its file, if one was given.
+        :return: None.
+        """
+        if self.cache_file is None:
+            return
+        with self.lock:
+            folders = dict(self.folders)
+        temp_file = self.cache_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(folders, f)
+        os.replace(temp_file, self.cache_file)
+
+    def get(self, folder_id):
+        """
+        Get a cached folder.
+        :param folder_id: folder ID.
+        :return: (name, parent ID) or None if the folder is not cached.
+        """
+        entry = self.folders.get(folder_id)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, folder_id, name, parent_id):
+        """
+        Cache a folder.
+        :param folder_id: folder ID.
+        :param name: folder name.
+        :param parent_id: ID of the first parent, None for a root.
+        :return: the cached (name, parent ID).
+        """
+        entry = (name, parent_id)
+        with self.lock:
+            self.folders[folder_id] = entry
+        return entry
+
+    def put_metadata(self, metadata):
+        """
+        Cache a folder from its Drive metadata.
+        :param metadata: metadata with id, name and parents.
+        :return: the cached (name, parent ID).
+        """
+        parents = metadata.get('parents')
+        return self.put(metadata['id'], metadata['name'], parents[0] if parents else None)
+
+    def invalidate(self, folder_id):
+        """
+        Drop a folder from the cache so the next lookup goes to Drive.
+        :param folder_id: folder ID.
+        :return: None.
+        """
+        with self.lock:
+            self.folders.pop(folder_id, None)
+
+    def __contains__(self, folder_id):
+        return folder_id in self.folders
@@ -0,0 +1,237 @@
+import contextlib
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+PROMETHEUS_PREFIX = "drive_sync"
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Latency histogram with fixed buckets.
+        :param buckets: upper bounds of the buckets in seconds.
+        """
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        for index, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.bucket_counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def report(self):
+        """
+        :return: dict with the count, total, mean and max in seconds and the count per bucket.
+        """
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        return {
+            "count": self.count,
+            "total": round(self.total, 6),
+            "mean": round(self.total / self.count, 6) if self.count else 0,
+            "max": round(self.max, 6),
+            "buckets": dict(zip(bounds, self.bucket_counts)),
+        }
+
+
+class Metrics:
+    def __init__(self, report_file=None, prometheus_file=None):
+        """
+        Timings and counters of a sync run, written as a JSON report at the end of each run.
+        Timings are named by phase ("pull_changes", "download", "filesystem.rename", "api.files.get", ...),
+        counters by what they count ("bytes_downloaded", "retries", ...). It can be used from any thread.
+        :param report_file: optional JSON file the report of the last run is written to.
+        :param prometheus_file: optional file the last run is written to in the Prometheus text format,
+        e.g. for the node exporter textfile collector.
+        """
+        self.report_file = report_file
+        self.prometheus_file = prometheus_file
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.counters = Counter()
+        self.mode = None
+        self.status = None
+        self.started = None
+        self.start_time = None
+        self.duration = 0.0
+        self.run_depth = 0
+        self.last_report = None
+
+    def reset(self):
+        with self.lock:
+            self.timings = {}
+            self.counters = Counter()
+
+    def observe(self, name, seconds):
+        """
+        Record the duration of one call.
+        :param name: phase name.
+        :param seconds: duration in seconds.
+        :return: None.
+        """
+        with self.lock:
+            histogram = self.timings.get(name)
+            if histogram is None:
+                histogram = self.timings[name] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, amount=1):
+        """
+        Increment a counter.
+        :param name: counter name.
+        :param amount: increment.
+        :return: None.
+        """
+        with self.lock:
+            self.counters[name] += amount
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        """
+        Time the enclosed block, the duration is recorded even if it raises.
+        :param name: phase name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @contextlib.contextmanager
+    def run(self, mode):
+        """
+        Measure a sync run, the metrics are reset when it starts and the report is written when it ends.
+        Nested runs are part of the outer run.
+        :param mode: sync mode, "activity" or "changes".
+        """
+        if self.run_depth == 0:
+            self.reset()
+            self.mode = mode
+            self.status = "running"
+            self.started = datetime.datetime.utcnow().isoformat() + 'Z'
+            self.start_time = time.perf_counter()
+        self.run_depth += 1
+        try:
+            yield
+            status = "done"
+        except BaseException as error:
+            status = type(error).__name__
+            raise
+        finally:
+            self.run_depth -= 1
+            if self.run_depth == 0:
+                self.status = status
+                self.duration = time.perf_counter() - self.start_time
+                self.write_reports()
+
+    def report(self):
+        """
+        Build the report of the last run.
+        :return: report dict.
+        """
+        with self.lock:
+            timings = {name: histogram.report() for name, histogram in sorted(self.timings.items())}
+            counters = dict(sorted(self.counters.items()))
+        return {
+            "started": self.started,
+            "mode": self.mode,
+            "status": self.status,
+            "duration": round(self.duration, 6),
+            "counters": counters,
+            "timings": timings,
+        }
+
+    def write_reports(self):
+        """
+        Write the report of the last run to the report files that were given.
+        :return: None.
+        """
+        self.last_report = self.report()
+        try:
+            if self.report_file is not None:
+                self.write_file(self.report_file, json.dumps(self.last_report, indent=2))
+            if self.prometheus_file is not None:
+                self.write_file(self.prometheus_file, self.prometheus_text())
+        except OSError as error:
+            print('Could not write the sync report: {}'.format(error))
+
+    @staticmethod
+    def write_file(file_name, text):
+        temp_file = file_name + ".tmp"
+        with open(temp_file, "w") as f:
+            f.write(text)
+        os.replace(temp_file, file_name)
+
+    def prometheus_text(self):
+        """
+        Render the last run in the Prometheus text exposition format.
+        :return: text.
+        """
+        report = self.last_report or self.report()
+        lines = [
+            f"# HELP {PROMETHEUS_PREFIX}_last_run_duration_seconds Duration of the last sync.",
+            f"# TYPE {PROMETHEUS_PREFIX}_last_run_duration_seconds gauge",
+            f'{PROMETHEUS_PREFIX}_last_run_duration_seconds{{mode="{report["mode"]}",status="{report["status"]}"}}'
+            f' {report["duration"]}',
+            f"# HELP {PROMETHEUS_PREFIX}_last_run_count Counters of the last sync.",
+            f"# TYPE {PROMETHEUS_PREFIX}_last_run_count gauge",
+        ]
+        for name, value in report["counters"].items():
+            lines.append(f'{PROMETHEUS_PREFIX}_last_run_count{{name="{name}"}} {value}')
+
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_phase_seconds Latency of each phase of the last sync.")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_phase_seconds histogram")
+        for name, timing in report["timings"].items():
+            cumulative = 0
+            for bound, count in timing["buckets"].items():
+                cumulative += count
+                lines.append(f'{PROMETHEUS_PREFIX}_phase_seconds_bucket{{phase="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{PROMETHEUS_PREFIX}_phase_seconds_sum{{phase="{name}"}} {timing["total"]}')
+            lines.append(f'{PROMETHEUS_PREFIX}_phase_seconds_count{{phase="{name}"}} {timing["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+def timed(name):
+    """
+    Decorate a method of an object with a metrics attribute, so each call is timed under a phase name.
+    :param name: phase name.
+    :return: decorator.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.measure(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def sync_run(mode):
+    """
+    Decorate a sync method of an object with a metrics attribute, so each call is measured as a run.
+    :param mode: sync mode.
+    :return: decorator.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.run(mode):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
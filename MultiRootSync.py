@@ -0,0 +1,242 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from BandwidthScheduler import divide_rates, parse_rate
+from Drive import SCOPES, GoogleDriveClient, SyncCancelled
+from Settings import ROOTS_DIRECTORY, ROOTS_FILE, load_cache, load_roots, save_cache
+from SyncDaemon import SyncDaemon
+
+# refresh the shared credentials when they expire within this many seconds, before a root sync starts
+REFRESH_MARGIN = 300
+
+# set in each worker process by init_worker, cancels the running sync when the parent stops
+stop_event = None
+
+
+def init_worker(event):
+    global stop_event
+    stop_event = event
+    # Ctrl+C goes to the whole process group, the parent stops the workers through the event instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def root_files(state_directory, name):
+    """
+    Get the state files of a root, every root keeps its own cache, checkpoint, index, folder cache and journal.
+    :param state_directory: directory holding one subdirectory per root.
+    :param name: root name.
+    :return: dict of paths.
+    """
+    directory = os.path.join(state_directory, name)
+    return {
+        "directory": directory,
+        "cache": os.path.join(directory, "cache.json"),
+        "folder_cache": os.path.join(directory, "folder_cache.json"),
+        "download_journal": os.path.join(directory, "downloads.json"),
+        "index": os.path.join(directory, "index"),
+        "metrics": os.path.join(directory, "sync_report.json"),
+        "checkpoint": os.path.join(directory, "checkpoint.json"),
+    }
+
+
+def print_root_events(name, events):
+    for event in events:
+        if event.kind != "progress":
+            print(f"[{name}] {event.describe()}", flush=True)
+
+
+def sync_root(root, credentials_info, state_directory, workers, hardlinks=False, max_rate=None, rate_windows=None):
+    """
+    Sync one root, runs in a worker process.
+    :param root: root from the roots file.
+    :param credentials_info: authorized user info refreshed by the parent process.
+    :param state_directory: directory holding the state of every root.
+    :param workers: number of concurrent downloads of the root.
+    :param hardlinks: copy identical files as hard links when the filesystem has no reflinks.
+    :param max_rate: bytes per second the downloads of the root may use, None for no cap.
+    :param rate_windows: parsed time-of-day caps of the root.
+    :return: number of changes applied.
+    """
+    from google.oauth2.credentials import Credentials
+
+    files = root_files(state_directory, root["name"])
+    os.makedirs(files["directory"], exist_ok=True)
+
+    # the roots file is the source of the settings, the cache of the root only keeps its position
+    data = load_cache(files["cache"])
+    if data["drive_id"] != root["drive_id"] or data["local_directory"] != root["local_directory"]:
+        data.update(timestamp="", page_token="")
+    data.update(local_directory=root["local_directory"], drive_id=root["drive_id"], sync_mode=root["sync_mode"])
+    save_cache(data, files["cache"])
+
+    credentials = Credentials.from_authorized_user_info(credentials_info, SCOPES) if credentials_info else None
+    drive_client = GoogleDriveClient(files["folder_cache"], download_workers=workers,
+                                     download_journal_file=files["download_journal"], index_directory=files["index"],
+                                     metrics_file=files["metrics"], checkpoint_file=files["checkpoint"],
+                                     credentials=credentials, filters=root["filters"], dedupe_hardlinks=hardlinks,
+                                     max_rate=max_rate, rate_windows=rate_windows)
+    drive_client.events_manager.subscribe(lambda events: print_root_events(root["name"], events))
+    drive_client.events_manager.start()
+
+    done = threading.Event()
+
+    def cancel_on_stop():
+        while not done.wait(0.5):
+            if stop_event is not None and stop_event.is_set():
+                drive_client.cancel()
+                return
+
+    threading.Thread(target=cancel_on_stop, daemon=True).start()
+    try:
+        return SyncDaemon(drive_client, files["cache"]).sync_once()
+    finally:
+        done.set()
+        drive_client.downloads.shutdown()
+        drive_client.events_manager.stop()
+
+
+class MultiRootSync:
+    def __init__(self, roots, state_directory=ROOTS_DIRECTORY, processes=None, workers=4, interval=300,
+                 max_interval=3600, credentials=None, hardlinks=False, max_rate=None, rate_windows=None):
+        """
+        Sync several roots in parallel, one worker process per running root, so a huge root does not hold back the
+        small ones and the syncs spread over the cores.
+        The credentials are refreshed once in this process and handed to every root sync.
+        :param roots: roots from the roots file.
+        :param state_directory: directory holding one subdirectory of state per root.
+        :param processes: number of roots synced at once, the number of CPUs by default.
+        :param workers: number of concurrent downloads of each root.
+        :param interval: seconds between two syncs of a root in daemon mode.
+        :param max_interval: longest wait of a root when nothing changes, the wait doubles after each empty sync.
+        :param credentials: shared credentials, None to let each root sync read token.json.
+        :param hardlinks: copy identical files as hard links when the filesystem has no reflinks.
+        :param max_rate: bytes per second the downloads of all the roots together may use, None for no cap.
+        :param rate_windows: time-of-day caps overriding max_rate, e.g. ["09:00-18:00=1M"].
+        The caps are split evenly between the roots syncing at once.
+        """
+        self.roots = roots
+        self.state_directory = state_directory
+        self.processes = processes or min(len(roots), os.cpu_count() or 1)
+        self.workers = workers
+        self.interval = interval
+        self.max_interval = max_interval
+        self.credentials = credentials
+        self.hardlinks = hardlinks
+        self.max_rate, self.rate_windows = divide_rates(max_rate, rate_windows, self.processes)
+        self.credentials_lock = threading.Lock()
+        self.stop_requested = threading.Event()
+        self.results = {}
+
+    def credentials_info(self):
+        """
+        Refresh the shared credentials if they are about to expire.
+        :return: authorized user info for the worker processes, or None.
+        """
+        if self.credentials is None:
+            return None
+        from google.auth.transport.requests import Request
+
+        with self.credentials_lock:
+            expiry = self.credentials.expiry
+            if not self.credentials.valid or (expiry is not None and (
+                    expiry - datetime.datetime.utcnow()).total_seconds() < REFRESH_MARGIN):
+                self.credentials.refresh(Request())
+                with open('token.json', 'w') as token:
+                    token.write(self.credentials.to_json())
+            return json.loads(self.credentials.to_json())
+
+    def run(self, daemon=False):
+        """
+        Sync every root, then keep syncing each root on its own schedule in daemon mode.
+        :param daemon: keep syncing until stopped.
+        :return: dict of root name to the number of changes applied, or to the error of the last sync.
+        """
+        stop_event = multiprocessing.Event()
+        next_runs = {root["name"]: 0 for root in self.roots}
+        waits = {root["name"]: self.interval for root in self.roots}
+        running = {}
+        with ProcessPoolExecutor(max_workers=self.processes, initializer=init_worker,
+                                 initargs=(stop_event,)) as pool:
+            while True:
+                if self.stop_requested.is_set():
+                    stop_event.set()
+                else:
+                    now = time.monotonic()
+                    for root in self.roots:
+                        name = root["name"]
+                        if name not in running and next_runs[name] is not None and next_runs[name] <= now:
+                            running[name] = pool.submit(sync_root, root, self.credentials_info(),
+                                                        self.state_directory, self.workers, self.hardlinks,
+                                                        self.max_rate, self.rate_windows)
+                            next_runs[name] = None
+                if not running:
+                    if not daemon or self.stop_requested.is_set():
+                        break
+                    self.stop_requested.wait(1)
+                    continue
+
+                done, _ = wait(running.values(), timeout=1, return_when=FIRST_COMPLETED)
+                for name, future in list(running.items()):
+                    if future not in done:
+                        continue
+                    del running[name]
+                    error = future.exception()
+                    self.results[name] = error if error is not None else future.result()
+                    if isinstance(error, SyncCancelled):
+                        print(f"[{name}] Syncing cancelled.", flush=True)
+                    elif error is not None:
+                        print(f"[{name}] An error occurred: {error}", flush=True)
+                    if daemon:
+                        changes = self.results[name] if error is None else 0
+                        waits[name] = self.interval if changes > 0 else min(waits[name] * 2, self.max_interval)
+                        next_runs[name] = time.monotonic() + waits[name]
+        return self.results
+
+    def stop(self):
+        """
+        Cancel the running root syncs, they save their checkpoint and resume on the next run.
+        :return: None.
+        """
+        self.stop_requested.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync several Google Drive folders in parallel without the GUI.")
+    parser.add_argument("--roots", default=ROOTS_FILE, help="JSON file listing the roots to sync")
+    parser.add_argument("--state", default=ROOTS_DIRECTORY, help="directory keeping the state of each root")
+    parser.add_argument("--daemon", action="store_true", help="keep syncing each root periodically")
+    parser.add_argument("--interval", type=int, default=300, help="seconds between two syncs of a root")
+    parser.add_argument("--max-interval", type=int, default=3600, help="longest wait when nothing changes")
+    parser.add_argument("--processes", type=int, help="number of roots synced at once, the CPU count by default")
+    parser.add_argument("--workers", type=int, default=4, help="number of concurrent downloads of each root")
+    parser.add_argument("--hardlinks", action="store_true",
+                        help="copy identical files as hard links when the filesystem has no reflinks")
+    parser.add_argument("--max-rate", type=parse_rate,
+                        help="bytes per second all the downloads together may use, e.g. 500K or 2M")
+    parser.add_argument("--rate-window", action="append", default=[],
+                        help="time-of-day cap overriding --max-rate, e.g. 09:00-18:00=1M, can be repeated")
+    args = parser.parse_args()
+
+    sync = MultiRootSync(load_roots(args.roots), args.state, args.processes, args.workers, args.interval,
+                         args.max_interval, GoogleDriveClient.load_credentials(), args.hardlinks,
+                         args.max_rate, args.rate_window)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sync.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: sync.stop())
+    for name, result in sync.run(args.daemon).items():
+        if isinstance(result, SyncCancelled):
+            print(f"{name}: cancelled")
+        elif isinstance(result, Exception):
+            print(f"{name}: failed, {result}")
+        else:
+            print(f"{name}: {result} changes applied")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import queue
+import threading
+
+# items put in the queue by the fetcher thread
+PAGE = "page"
+ERROR = "error"
+DONE = "done"
+
+
+class PagePrefetcher:
+    def __init__(self, fetch_page, next_token, first_token=None, depth=1):
+        """
+        Fetch the pages of a paged API on a background thread, staying up to depth pages ahead of the consumer,
+        so fetching the next page overlaps with processing the current one.
+        :param fetch_page: function fetching a page from its page token.
+        :param next_token: function getting the token of the next page from a page, None after the last page.
+        :param first_token: token of the first page.
+        :param depth: number of pages fetched ahead.
+        """
+        self.fetch_page = fetch_page
+        self.next_token = next_token
+        self.first_token = first_token
+        self.pages = queue.Queue(maxsize=max(1, depth))
+        self.stopped = threading.Event()
+        self.fetcher = threading.Thread(target=self.fetch_pages, name="prefetch", daemon=True)
+
+    def __iter__(self):
+        """
+        Iterate over the pages in order, an error of the fetcher is raised where its page would have been.
+        :return: pages.
+        """
+        self.fetcher.start()
+        try:
+            while True:
+                kind, item = self.pages.get()
+                if kind == DONE:
+                    return
+                if kind == ERROR:
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def fetch_pages(self):
+        token = self.first_token
+        while not self.stopped.is_set():
+            try:
+                page = self.fetch_page(token)
+                token = self.next_token(page)
+            except BaseException as error:
+                self.put(ERROR, error)
+                return
+            if not self.put(PAGE, page):
+                return
+            if token is None:
+                self.put(DONE, None)
+                return
+
+    def put(self, kind, item):
+        """
+        Queue an item, waiting while the consumer is depth pages behind.
+        :return: True if queued, False if the prefetcher was stopped.
+        """
+        while not self.stopped.is_set():
+            try:
+                self.pages.put((kind, item), timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def close(self):
+        """
+        Stop the fetcher, e.g. when the consumer stops early or fails.
+        :return: None.
+        """
+        self.stopped.set()
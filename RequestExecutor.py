@@ -0,0 +1,199 @@
+import json
+import random
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+# server errors and request timeouts are retried
+RETRIABLE_STATUSES = {408, 500, 502, 503, 504}
+
+# quota errors are retried and also lower the concurrency limit
+THROTTLE_STATUSES = {429}
+THROTTLE_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+
+def error_reason(error):
+    """
+    Get the reason of a Google API error, e.g. "rateLimitExceeded".
+    :param error: HttpError.
+    :return: reason or None.
+    """
+    try:
+        data = json.loads(error.content.decode("utf-8"))
+        return data["error"]["errors"][0]["reason"]
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+def is_throttled(error):
+    """
+    Check if an error means the quota was exceeded.
+    :param error: exception raised by a request.
+    :return: True if throttled, False otherwise.
+    """
+    if not isinstance(error, HttpError):
+        return False
+    return error.resp.status in THROTTLE_STATUSES or (error.resp.status == 403 and
+                                                      error_reason(error) in THROTTLE_REASONS)
+
+
+def is_retriable(error):
+    """
+    Check if a failed request can be retried: quota errors, server errors and connection errors.
+    :param error: exception raised by a request.
+    :return: True if retriable, False otherwise.
+    """
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRIABLE_STATUSES or is_throttled(error)
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        """
+        Token bucket rate limit.
+        :param rate: tokens added per second.
+        :param burst: maximum number of tokens.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting for one if the bucket is empty.
+        :return: seconds waited.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class ConcurrencyLimit:
+    def __init__(self, max_limit, min_limit=1):
+        """
+        Adaptive limit of the requests in flight: it grows by one every limit successful requests
+        and halves when a request is throttled.
+        :param max_limit: highest limit, also the initial limit.
+        :param min_limit: lowest limit.
+        """
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def throttle(self):
+        """
+        Halve the limit, for quota errors reported without a failed request, e.g. inside a batch.
+        :return: None.
+        """
+        with self.condition:
+            self.limit = max(self.min_limit, self.limit / 2)
+
+
+class RequestExecutor:
+    def __init__(self, metrics, rate=50, burst=100, max_concurrency=8, max_retries=6, base_delay=1, max_delay=64,
+                 cancel_event=None):
+        """
+        Single path every Google API request goes through: a token bucket rate limit, an adaptive concurrency
+        limit and retries with exponential backoff and full jitter on quota, server and connection errors.
+        :param metrics: Metrics, each attempt is timed and the retries and throttled requests are counted.
+        :param rate: requests per second.
+        :param burst: requests allowed at once after an idle period.
+        :param max_concurrency: highest number of requests in flight.
+        :param max_retries: retries of a request before its error is raised.
+        :param base_delay: delay in seconds before the first retry, doubled for each retry.
+        :param max_delay: longest delay in seconds between two retries.
+        :param cancel_event: event interrupting the backoff, the request is not retried once it is set.
+        """
+        self.metrics = metrics
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = ConcurrencyLimit(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cancel_event = cancel_event or threading.Event()
+
+    def execute(self, call, name):
+        """
+        Run a request, retrying it while it fails with a retriable error.
+        :param call: function sending the request, e.g. request.execute or downloader.next_chunk.
+        :param name: name the attempts are timed under.
+        :return: result of the call.
+        """
+        attempt = 0
+        while True:
+            try:
+                return self.attempt(call, name)
+            except Exception as error:
+                if not is_retriable(error) or attempt >= self.max_retries or not self.backoff(attempt, error):
+                    raise
+                attempt += 1
+
+    def attempt(self, call, name):
+        """
+        Send a request once, within the rate and concurrency limits.
+        :param call: function sending the request.
+        :param name: name the attempt is timed under.
+        :return: result of the call.
+        """
+        waited = self.bucket.acquire()
+        if waited:
+            self.metrics.observe("rate_limit_wait", waited)
+        self.concurrency.acquire()
+        throttled = False
+        try:
+            with self.metrics.measure(name):
+                return call()
+        except Exception as error:
+            throttled = is_throttled(error)
+            raise
+        finally:
+            self.concurrency.release(throttled)
+
+    def backoff(self, attempt, error):
+        """
+        Wait before retrying a failed request, honoring the Retry-After header of the response.
+        :param attempt: number of retries already done.
+        :param error: error of the failed request.
+        :return: True if the request can be retried, False if the wait was cancelled.
+        """
+        self.metrics.count("retries")
+        if is_throttled(error):
+            self.metrics.count("throttled")
+        print('Retrying after an error: {}'.format(error))
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        response = getattr(error, 'resp', None)
+        retry_after = response.get('retry-after') if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        return not self.cancel_event.wait(delay)
@@ -0,0 +1,68 @@
+import json
+import os
+
+CACHE_FILE = "cache.json"
+FOLDER_CACHE_FILE = "folder_cache.json"
+DOWNLOAD_JOURNAL_FILE = "downloads.json"
+INDEX_DIRECTORY = "index"
+METRICS_FILE = "sync_report.json"
+CHECKPOINT_FILE = "checkpoint.json"
+ROOTS_FILE = "roots.json"
+ROOTS_DIRECTORY = "roots"
+
+DEFAULT_CACHE = {
+    "timestamp": "",
+    "local_directory": "",
+    "drive_id": "",
+    "sync_mode": "activity",
+    "page_token": "",
+}
+
+
+def load_cache(cache_file=CACHE_FILE):
+    """
+    Read the cache file, it is created with the default values if it does not exist.
+    :param cache_file: cache file.
+    :return: cache data.
+    """
+    data = dict(DEFAULT_CACHE)
+    if os.path.exists(cache_file):
+        with open(cache_file, "r") as f:
+            data.update(json.load(f))
+    else:
+        save_cache(data, cache_file)
+    return data
+
+
+def save_cache(data, cache_file=CACHE_FILE):
+    """
+    Write the cache file through a temporary file, so it is never left half written.
+    :param data: cache data.
+    :param cache_file: cache file.
+    :return: None.
+    """
+    temp_file = cache_file + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(data, f)
+    os.replace(temp_file, cache_file)
+
+
+def load_roots(roots_file=ROOTS_FILE):
+    """
+    Read the roots to sync, each with its local directory, Drive folder ID and optional sync mode and filters.
+    :param roots_file: JSON file with a "roots" list.
+    :return: list of roots, each named after its "name" or its Drive folder ID.
+    """
+    with open(roots_file, "r") as f:
+        roots = json.load(f)["roots"]
+    names = set()
+    for root in roots:
+        if not root.get("local_directory") or not root.get("drive_id"):
+            raise ValueError(f"every root in {roots_file} needs a local_directory and a drive_id")
+        root.setdefault("name", root["drive_id"])
+        root.setdefault("sync_mode", DEFAULT_CACHE["sync_mode"])
+        root.setdefault("filters", {})
+        if root["name"] in names:
+            raise ValueError(f"root name {root['name']} is used twice in {roots_file}")
+        names.add(root["name"])
+    return roots
@@ -0,0 +1,101 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# each step runs in a fresh interpreter, so nothing is already imported or built
+STEPS = {
+    "import": """
+import time
+start = time.perf_counter()
+import Drive
+print(time.perf_counter() - start)
+""",
+    "client": """
+import tempfile
+import time
+start = time.perf_counter()
+from Drive import GoogleDriveClient
+with tempfile.TemporaryDirectory() as directory:
+    client = GoogleDriveClient(directory + "/folder_cache.json", index_directory=directory + "/index")
+    print(time.perf_counter() - start)
+    client.downloads.shutdown()
+""",
+    "services": """
+import time
+from google.oauth2.credentials import Credentials
+from Drive import GoogleDriveClient
+credentials = Credentials("token", refresh_token="refresh", client_id="id", client_secret="secret")
+start = time.perf_counter()
+GoogleDriveClient.authenticate(credentials)
+print(time.perf_counter() - start)
+""",
+}
+
+DESCRIPTIONS = {
+    "import": "import Drive",
+    "client": "import and create the client",
+    "services": "build the Drive services",
+}
+
+
+def time_step(name):
+    """
+    Time a startup step in a new Python process.
+    :param name: step name.
+    :return: seconds taken by the step.
+    """
+    output = subprocess.run([sys.executable, "-c", STEPS[name]], capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def check_regressions(results, baseline_file, tolerance):
+    """
+    Compare the median times with a previous report.
+    :return: list of regression descriptions.
+    """
+    with open(baseline_file, "r") as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for name, median in results.items():
+        previous = baseline.get(name)
+        if previous is not None and median > previous * (1 + tolerance):
+            regressions.append(f"{name}: went from {previous * 1000:.1f} ms to {median * 1000:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the startup of the sync client, without network access.")
+    parser.add_argument("steps", nargs="*", help="steps to time, all by default: " + ", ".join(STEPS))
+    parser.add_argument("--runs", type=int, default=5, help="runs of each step, the median is reported")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="fail if a step got slower than in this results file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown compared to the baseline")
+    args = parser.parse_args()
+    for name in args.steps:
+        if name not in STEPS:
+            parser.error(f"unknown step {name}")
+
+    results = {}
+    print(f"{'step':<32}{'median':>10}{'min':>10}")
+    for name in args.steps or STEPS:
+        times = [time_step(name) for _ in range(args.runs)]
+        results[name] = statistics.median(times)
+        print(f"{DESCRIPTIONS[name]:<32}{results[name] * 1000:>8.1f}ms{min(times) * 1000:>8.1f}ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        regressions = check_regressions(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
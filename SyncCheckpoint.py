@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+
+PENDING = "pending"
+FAILED = "failed"
+
+
+class SyncCheckpoint:
+    def __init__(self, checkpoint_file=None):
+        """
+        Progress of the running sync, saved after each applied page so a crashed or cancelled sync resumes
+        where it stopped instead of starting over.
+        A sync starts from the timestamp or page token saved in cache.json by the last completed sync, the
+        checkpoint is only used when it was written by a sync starting from that same position.
+        :param checkpoint_file: optional JSON file to keep the checkpoint between runs.
+        """
+        self.checkpoint_file = checkpoint_file
+        self.drive_id = None
+        self.start = None
+        self.timestamp = None
+        self.page_token = None
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Load the checkpoint from its file if it exists.
+        :return: None.
+        """
+        if self.checkpoint_file is None or not os.path.exists(self.checkpoint_file):
+            return
+        try:
+            with open(self.checkpoint_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as error:
+            print('Could not read the sync checkpoint: {}'.format(error))
+            return
+        self.drive_id = data.get("drive_id")
+        self.start = data.get("start")
+        self.timestamp = data.get("timestamp")
+        self.page_token = data.get("page_token")
+        self.files = data.get("files", {})
+
+    def resume(self, drive_id, start):
+        """
+        Start a sync, continuing the checkpointed one if it started from the same position.
+        :param drive_id: Google Drive folder ID.
+        :param start: timestamp or page token the sync starts from.
+        :return: True if the checkpointed position applies, False if the sync starts over.
+        """
+        with self.lock:
+            if self.drive_id != drive_id:
+                # unfinished files belong to another folder
+                self.files = {}
+            elif self.start == start:
+                return True
+            self.drive_id = drive_id
+            self.start = start
+            self.timestamp = None
+            self.page_token = None
+            return False
+
+    def unfinished_files(self):
+        """
+        :return: IDs of the files whose download was pending when the checkpoint was saved or failed.
+        """
+        with self.lock:
+            return list(self.files)
+
+    def set_file_status(self, file_id, status):
+        """
+        Record the status of a file download, None once it is done.
+        :param file_id: file ID.
+        :param status: PENDING, FAILED or None.
+        :return: None.
+        """
+        with self.lock:
+            if status is None:
+                self.files.pop(file_id, None)
+            else:
+                self.files[file_id] = status
+
+    def save(self, timestamp=None, page_token=None):
+        """
+        Save the position of the sync: everything before it is applied, except the unfinished files.
+        The file is written through a temporary file, so it is never left half written.
+        :param timestamp: timestamp of the last applied activity, for the Drive Activity sync.
+        :param page_token: page token of the next changes page, for the Changes API sync.
+        :return: None.
+        """
+        with self.lock:
+            if timestamp is not None:
+                self.timestamp = timestamp
+            if page_token is not None:
+                self.page_token = page_token
+            if self.checkpoint_file is None:
+                return
+            data = {
+                "drive_id": self.drive_id,
+                "start": self.start,
+                "timestamp": self.timestamp,
+                "page_token": self.page_token,
+                "files": self.files,
+            }
+            temp_file = self.checkpoint_file + ".tmp"
+            with open(temp_file, "w") as f:
+                json.dump(data, f)
+            os.replace(temp_file, self.checkpoint_file)
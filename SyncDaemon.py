@@ -0,0 +1,140 @@
+import argparse
+import datetime
+import random
+import signal
+import threading
+
+from BandwidthScheduler import parse_rate
+from Drive import ACTIVITY_PAGE_SIZE, CHANGES_PAGE_SIZE, PREFETCH_PAGES, GoogleDriveClient, SyncCancelled
+from Settings import (CACHE_FILE, CHECKPOINT_FILE, DOWNLOAD_JOURNAL_FILE, FOLDER_CACHE_FILE, INDEX_DIRECTORY,
+                      METRICS_FILE, load_cache, save_cache)
+from Uploader import UploadPipeline
+
+
+class SyncDaemon:
+    def __init__(self, drive_client, cache_file=CACHE_FILE, interval=300, max_interval=3600, upload_pipeline=None):
+        """
+        Headless sync, without any PyQt5 import, reading the same cache.json settings as the app.
+        :param drive_client: Google Drive client.
+        :param cache_file: cache file with the directory, Drive folder ID, sync mode and checkpoint.
+        :param interval: seconds between two syncs.
+        :param max_interval: longest wait when nothing changes, the wait doubles after each empty sync.
+        :param upload_pipeline: optional UploadPipeline, started after the first sync to upload local changes.
+        """
+        self.drive_client = drive_client
+        self.cache_file = cache_file
+        self.interval = interval
+        self.max_interval = max_interval
+        self.upload_pipeline = upload_pipeline
+        self.stop_requested = threading.Event()
+
+    def sync_once(self):
+        """
+        Run one incremental sync and save the new checkpoint.
+        :return: number of changes applied.
+        """
+        data = load_cache(self.cache_file)
+        if data["local_directory"] == "" or data["drive_id"] == "":
+            raise ValueError(f"local_directory and drive_id must be set in {self.cache_file}")
+
+        current_timestamp = datetime.datetime.utcnow().isoformat() + 'Z'
+        self.drive_client.build_drive_client(data["local_directory"], data["drive_id"], data["timestamp"])
+        if data["sync_mode"] == "changes":
+            data["page_token"] = self.drive_client.sync_changes(data["page_token"], current_timestamp)
+        else:
+            self.drive_client.get_changes_and_download(current_timestamp)
+            data["page_token"] = ""
+        data["timestamp"] = current_timestamp
+        save_cache(data, self.cache_file)
+        return self.drive_client.changes_applied
+
+    def run_forever(self):
+        """
+        Sync periodically until stopped. When nothing changes, the wait backs off exponentially up to
+        max_interval, with jitter so several daemons do not poll in step.
+        Local changes are watched once the first sync succeeded, so the downloads it makes are already indexed.
+        :return: None.
+        """
+        wait = self.interval
+        watching = False
+        while not self.stop_requested.is_set():
+            try:
+                changes = self.sync_once()
+            except SyncCancelled:
+                break
+            except Exception as error:
+                print('An error occurred: {}'.format(error))
+                changes = 0
+            else:
+                if self.upload_pipeline is not None and not watching:
+                    watching = self.upload_pipeline.start()
+
+            wait = self.interval if changes > 0 else min(wait * 2, self.max_interval)
+            self.stop_requested.wait(wait * random.uniform(0.8, 1.2))
+
+    def stop(self):
+        self.stop_requested.set()
+        self.drive_client.cancel()
+
+
+def print_events(events):
+    for event in events:
+        if event.kind != "progress":
+            print(event.describe(), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync a Google Drive folder without the GUI.")
+    parser.add_argument("--daemon", action="store_true", help="keep syncing periodically")
+    parser.add_argument("--interval", type=int, default=300, help="seconds between two syncs in daemon mode")
+    parser.add_argument("--max-interval", type=int, default=3600, help="longest wait when nothing changes")
+    parser.add_argument("--cache", default=CACHE_FILE, help="cache file with the sync settings")
+    parser.add_argument("--workers", type=int, default=4, help="number of concurrent downloads")
+    parser.add_argument("--activity-page-size", type=int, default=ACTIVITY_PAGE_SIZE,
+                        help="activities requested per Drive Activity page")
+    parser.add_argument("--changes-page-size", type=int, default=CHANGES_PAGE_SIZE,
+                        help="changes requested per Changes API page, at most 1000")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH_PAGES,
+                        help="pages fetched in the background ahead of the page being applied")
+    parser.add_argument("--hardlinks", action="store_true",
+                        help="copy identical files as hard links when the filesystem has no reflinks")
+    parser.add_argument("--max-rate", type=parse_rate,
+                        help="bytes per second all the downloads together may use, e.g. 500K or 2M")
+    parser.add_argument("--rate-window", action="append", default=[],
+                        help="time-of-day cap overriding --max-rate, e.g. 09:00-18:00=1M, can be repeated")
+    parser.add_argument("--watch", action="store_true",
+                        help="in daemon mode, also upload the local changes to Drive (needs watchdog)")
+    parser.add_argument("--metrics-file", default=METRICS_FILE, help="JSON report of the timings of the last sync")
+    parser.add_argument("--prometheus-file", help="also write the report in the Prometheus text format to this file")
+    args = parser.parse_args()
+
+    drive_client = GoogleDriveClient(FOLDER_CACHE_FILE, download_workers=args.workers,
+                                     download_journal_file=DOWNLOAD_JOURNAL_FILE, index_directory=INDEX_DIRECTORY,
+                                     metrics_file=args.metrics_file, prometheus_file=args.prometheus_file,
+                                     checkpoint_file=CHECKPOINT_FILE, dedupe_hardlinks=args.hardlinks,
+                                     activity_page_size=args.activity_page_size,
+                                     changes_page_size=args.changes_page_size, prefetch_pages=args.prefetch,
+                                     max_rate=args.max_rate, rate_windows=args.rate_window)
+    drive_client.events_manager.subscribe(print_events)
+    drive_client.events_manager.start()
+
+    upload_pipeline = UploadPipeline(drive_client, workers=args.workers) if args.watch else None
+    daemon = SyncDaemon(drive_client, args.cache, args.interval, args.max_interval, upload_pipeline)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: daemon.stop())
+    try:
+        if args.daemon:
+            daemon.run_forever()
+        else:
+            daemon.sync_once()
+    except SyncCancelled:
+        print("Syncing cancelled.")
+    finally:
+        if upload_pipeline is not None:
+            upload_pipeline.stop()
+        drive_client.downloads.shutdown()
+        drive_client.events_manager.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import fnmatch
+import re
+
+# rules applied when a filter sets no exclude rules of its own: audio and video are not synced
+DEFAULT_EXCLUDE = [
+    "mime:application/vnd.google-apps.audio",
+    "mime:application/vnd.google-apps.video",
+    "mime:video/*",
+    "mime:audio/*",
+]
+
+# prefixes of the rule kinds, a rule without a prefix matches the name
+RULE_KINDS = ("name", "path", "mime")
+
+
+def compile_globs(patterns):
+    """
+    Compile glob patterns into one regular expression.
+    :param patterns: glob patterns.
+    :return: compiled expression matching any of the patterns, or None if there are none.
+    """
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(pattern)})" for pattern in patterns))
+
+
+def split_rules(rules):
+    """
+    Sort rules by kind, e.g. "mime:video/*", "path:Photos/Raw/*", "name:*.iso" or "*.iso".
+    :param rules: rules.
+    :return: dict of rule kind to compiled expression.
+    """
+    patterns = {kind: [] for kind in RULE_KINDS}
+    for rule in rules:
+        kind, separator, pattern = rule.partition(":")
+        if separator and kind in patterns:
+            patterns[kind].append(pattern)
+        else:
+            patterns["name"].append(rule)
+    return {kind: compile_globs(kind_patterns) for kind, kind_patterns in patterns.items()}
+
+
+class SyncFilter:
+    def __init__(self, include=None, exclude=None, min_size=None, max_size=None):
+        """
+        Selective sync rules, compiled once into one expression per rule kind.
+        A file is synced if it matches an include rule, or if there are none, and no exclude rule.
+        Rules match the name, the path relative to the synced folder with "/" separators, or the MIME type.
+        Exclude rules matching a folder name or path prune the whole folder, it is never listed nor created.
+        :param include: include rules, e.g. ["*.pdf", "path:Courses/*"].
+        :param exclude: exclude rules, DEFAULT_EXCLUDE if None.
+        :param min_size: smallest synced file size in bytes.
+        :param max_size: largest synced file size in bytes.
+        """
+        self.include = split_rules(include or [])
+        self.exclude = split_rules(DEFAULT_EXCLUDE if exclude is None else exclude)
+        self.has_include = any(expression is not None for expression in self.include.values())
+        self.min_size = min_size
+        self.max_size = max_size
+        # directory to pruned, most files share their directory with many others
+        self.pruned = {"": False}
+
+    @classmethod
+    def from_config(cls, filters):
+        """
+        Build a filter from a "filters" setting of the roots file.
+        :param filters: dict with optional include, exclude, min_size and max_size.
+        :return: SyncFilter.
+        """
+        filters = filters or {}
+        return cls(filters.get("include"), filters.get("exclude"), filters.get("min_size"), filters.get("max_size"))
+
+    @staticmethod
+    def matches(expression, text):
+        return expression is not None and text is not None and expression.match(text) is not None
+
+    def excludes_type(self, mime_type):
+        """
+        :param mime_type: MIME type.
+        :return: True if an exclude rule matches the MIME type.
+        """
+        return self.matches(self.exclude["mime"], mime_type)
+
+    def excludes_file(self, name, mime_type=None, size=None):
+        """
+        Check the rules that need no path, so a file can be dropped before its metadata or ancestors are fetched.
+        :param name: file name.
+        :param mime_type: MIME type, if known.
+        :param size: size in bytes, if known.
+        :return: True if the file is excluded.
+        """
+        if self.matches(self.exclude["name"], name) or self.excludes_type(mime_type):
+            return True
+        if size is not None:
+            size = int(size)
+            if (self.min_size is not None and size < self.min_size) or (
+                    self.max_size is not None and size > self.max_size):
+                return True
+        return False
+
+    def is_pruned(self, directory):
+        """
+        Check if a folder or one of its ancestors is excluded.
+        :param directory: folder path relative to the synced folder, "" for the synced folder.
+        :return: True if everything under the folder is excluded.
+        """
+        pruned = self.pruned.get(directory)
+        if pruned is None:
+            parent, _, name = directory.rpartition("/")
+            pruned = (self.is_pruned(parent) or self.matches(self.exclude["name"], name) or
+                      self.matches(self.exclude["path"], directory))
+            self.pruned[directory] = pruned
+        return pruned
+
+    def is_excluded(self, relative_path, mime_type=None, size=None):
+        """
+        Check every rule against a file.
+        :param relative_path: path relative to the synced folder with "/" separators.
+        :param mime_type: MIME type, if known.
+        :param size: size in bytes, if known.
+        :return: True if the file is not synced.
+        """
+        directory, _, name = relative_path.rpartition("/")
+        if self.is_pruned(directory) or self.excludes_file(name, mime_type, size):
+            return True
+        if self.matches(self.exclude["path"], relative_path):
+            return True
+        if not self.has_include:
+            return False
+        return not (self.matches(self.include["name"], name) or self.matches(self.include["path"], relative_path) or
+                    self.matches(self.include["mime"], mime_type))
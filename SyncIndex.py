@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_id TEXT PRIMARY KEY,
+    local_path TEXT NOT NULL,
+    mime_type TEXT,
+    md5_checksum TEXT,
+    modified_time TEXT,
+    size INTEGER,
+    extension TEXT NOT NULL DEFAULT '',
+    head_revision_id TEXT,
+    version INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_local_path ON files (local_path);
+CREATE INDEX IF NOT EXISTS files_md5_checksum ON files (md5_checksum);
+"""
+
+COLUMNS = ("file_id", "local_path", "mime_type", "md5_checksum", "modified_time", "size", "extension",
+           "head_revision_id", "version")
+
+# columns added after the first schema, added to older index files when they are opened
+ADDED_COLUMNS = {
+    "head_revision_id": "TEXT",
+    "version": "INTEGER",
+}
+
+
+class SyncIndex:
+    def __init__(self, index_file=":memory:"):
+        """
+        Persistent index of what the sync put on disk, keyed by Drive file ID.
+        :param index_file: SQLite database file, in memory by default.
+        """
+        self.index_file = index_file
+        # downloads update the index from worker threads
+        self.connection = sqlite3.connect(index_file, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+            existing_columns = {row['name'] for row in self.connection.execute("PRAGMA table_info(files)")}
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in existing_columns:
+                    self.connection.execute("ALTER TABLE files ADD COLUMN {} {}".format(column, column_type))
+
+    def get(self, file_id):
+        """
+        Get the entry of a file.
+        :param file_id: file ID.
+        :return: dict with the columns of the entry, or None.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM files WHERE file_id = ?", (file_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def find(self, local_path):
+        """
+        Get the entry of the file at a local path.
+        :param local_path: path of the file on disk, including the exported extension.
+        :return: dict with the columns of the entry, or None.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM files WHERE local_path = ?", (local_path,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def find_checksum(self, md5_checksum, size):
+        """
+        Get the local paths of the files with some content.
+        :param md5_checksum: MD5 checksum of the content.
+        :param size: size of the content in bytes.
+        :return: list of local paths.
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT local_path FROM files WHERE md5_checksum = ? AND size = ?",
+                                           (md5_checksum, size)).fetchall()
+        return [row['local_path'] for row in rows]
+
+    def get_path(self, file_id):
+        """
+        Get the local path of a file, if it is still on disk.
+        :param file_id: file ID.
+        :return: local path or None.
+        """
+        entry = self.get(file_id)
+        if entry is None or not os.path.exists(entry['local_path']):
+            return None
+        return entry['local_path']
+
+    def put(self, file_id, local_path, file_metadata=None, extension=""):
+        """
+        Add or update the entry of a file.
+        :param file_id: file ID.
+        :param local_path: path of the file on disk, including the exported extension.
+        :param file_metadata: file metadata with mimeType, md5Checksum, modifiedTime, size, headRevisionId and version.
+        :param extension: extension added when the file was exported.
+        :return: None.
+        """
+        file_metadata = file_metadata or {}
+        size = file_metadata.get('size')
+        version = file_metadata.get('version')
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files ({}) VALUES ({})".format(", ".join(COLUMNS),
+                                                                      ", ".join("?" * len(COLUMNS))),
+                (file_id, local_path, file_metadata.get('mimeType'), file_metadata.get('md5Checksum'),
+                 file_metadata.get('modifiedTime'), int(size) if size is not None else None, extension,
+                 file_metadata.get('headRevisionId'), int(version) if version is not None else None)
+            )
+
+    def move_tree(self, old_path, new_path):
+        """
+        Update the path of an entry and of every entry under it, in one transaction.
+        :param old_path: old local path of a file or folder.
+        :param new_path: new local path.
+        :return: None.
+        """
+        prefix = os.path.join(old_path, "")
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE files SET local_path = ? || substr(local_path, ?)"
+                " WHERE local_path = ? OR substr(local_path, 1, ?) = ?",
+                (new_path, len(old_path) + 1, old_path, len(prefix), prefix)
+            )
+
+    def remove_tree(self, local_path):
+        """
+        Remove the entry at a path and every entry under it, in one transaction.
+        :param local_path: local path of a file or folder.
+        :return: None.
+        """
+        prefix = os.path.join(local_path, "")
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM files WHERE local_path = ? OR substr(local_path, 1, ?) = ?",
+                (local_path, len(prefix), prefix)
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
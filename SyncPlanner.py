@@ -0,0 +1,111 @@
+import copy
+
+# actions after which an earlier download of the same file is still needed
+ORDERING_ACTIONS = ('rename', 'move', 'delete', 'restore')
+
+
+class SyncPlanner:
+    def __init__(self):
+        self.removed = 0
+
+    @staticmethod
+    def get_action(activity):
+        """
+        Get the action of an activity.
+        :param activity: Google Drive Activity object.
+        :return: action type.
+        """
+        return list(activity['primaryActionDetail'].keys())[0]
+
+    def plan(self, items):
+        """
+        Reduce the activity stream to a minimal net plan per file before any event is dispatched.
+        - Create followed by delete cancels out, with everything that happened in between.
+        - Only the last of consecutive edits is kept, and edits right after a create are dropped.
+        - Consecutive renames collapse into one rename from the first old title to the last new title, unless one of
+          their titles is also in a rename of another file, e.g. a swap through a temporary name.
+        :param items: (activity, file ID) pairs in chronological order.
+        :return: (activity, file ID) pairs in chronological order.
+        """
+        items_by_file = {}
+        for index, (activity, file_id) in enumerate(items):
+            items_by_file.setdefault(file_id, []).append(index)
+
+        rename_titles = {}
+        for activity, file_id in items:
+            if self.get_action(activity) == 'rename':
+                rename = activity['primaryActionDetail']['rename']
+                for title in (rename['oldTitle'], rename['newTitle']):
+                    rename_titles.setdefault(title, set()).add(file_id)
+
+        planned = {}
+        for file_id, indexes in items_by_file.items():
+            kept = self.cancel_created_and_deleted(items, indexes)
+            kept = self.drop_superseded_edits(items, kept)
+            if any(len(file_ids) > 1 and file_id in file_ids for file_ids in rename_titles.values()):
+                planned.update((index, items[index]) for index in kept)
+            else:
+                planned.update(self.collapse_renames(items, kept))
+
+        plan = [planned[index] for index in sorted(planned)]
+        self.removed = len(items) - len(plan)
+        return plan
+
+    def cancel_created_and_deleted(self, items, indexes):
+        kept = []
+        for index in indexes:
+            if self.get_action(items[index][0]) == 'delete':
+                created = [position for position, kept_index in enumerate(kept)
+                           if self.get_action(items[kept_index][0]) == 'create']
+                if created:
+                    del kept[created[-1]:]
+                    continue
+            kept.append(index)
+        return kept
+
+    def drop_superseded_edits(self, items, indexes):
+        kept = []
+        last_content = None
+        for index in indexes:
+            action = self.get_action(items[index][0])
+            if action in ORDERING_ACTIONS:
+                last_content = None
+            elif action == 'edit' and last_content is not None:
+                if self.get_action(items[last_content][0]) == 'create':
+                    continue
+                kept.remove(last_content)
+            if action in ('create', 'edit'):
+                last_content = index
+            kept.append(index)
+        return kept
+
+    def collapse_renames(self, items, indexes):
+        planned = {}
+        chain_start = None
+        for index in indexes:
+            activity, file_id = items[index]
+            if self.get_action(activity) != 'rename':
+                chain_start = None
+                planned[index] = items[index]
+                continue
+
+            if chain_start is None:
+                chain_start = index
+                planned[index] = items[index]
+                continue
+
+            # keep the chain at its last position, so it stays ordered with the renames of other files, e.g. a swap
+            # through a temporary name. A replay from inside the chain finds the file by ID in the index.
+            previous_activity = planned.pop(chain_start)[0]
+            collapsed = copy.deepcopy(activity)
+            collapsed['primaryActionDetail']['rename']['oldTitle'] = \
+                previous_activity['primaryActionDetail']['rename']['oldTitle']
+            planned[index] = (collapsed, file_id)
+            chain_start = index
+
+        for index, (activity, file_id) in list(planned.items()):
+            if self.get_action(activity) == 'rename':
+                rename = activity['primaryActionDetail']['rename']
+                if rename['oldTitle'] == rename['newTitle']:
+                    del planned[index]
+        return planned
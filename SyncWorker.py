@@ -0,0 +1,55 @@
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from Drive import SyncCancelled
+
+
+class SyncWorker(QObject):
+    # queued to the GUI thread, the sync never touches the widgets itself
+    events = pyqtSignal(list)
+    finished = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(str)
+    stopped = pyqtSignal()
+
+    def __init__(self, drive_client, sync_mode, page_token, call_timestamp):
+        """
+        Sync job run on a QThread.
+        :param drive_client: Google Drive client, already built for the directory and Drive folder.
+        :param sync_mode: "activity" or "changes".
+        :param page_token: start page token of the changes sync.
+        :param call_timestamp: timestamp of the call.
+        """
+        super(SyncWorker, self).__init__()
+        self.drive_client = drive_client
+        self.sync_mode = sync_mode
+        self.page_token = page_token
+        self.call_timestamp = call_timestamp
+
+    def publish(self, events):
+        self.events.emit(events)
+
+    def cancel(self):
+        self.drive_client.cancel()
+
+    def run(self):
+        events_manager = self.drive_client.events_manager
+        events_manager.subscribe(self.publish)
+        events_manager.start()
+        try:
+            if self.sync_mode == "changes":
+                page_token = self.drive_client.sync_changes(self.page_token, self.call_timestamp)
+            else:
+                self.drive_client.get_changes_and_download(self.call_timestamp)
+                page_token = ""
+            self.finished.emit(page_token)
+        except SyncCancelled:
+            self.drive_client.downloads.wait_all()
+            self.cancelled.emit()
+        except Exception as error:
+            print('An error occurred: {}'.format(error))
+            self.drive_client.downloads.wait_all()
+            self.failed.emit(str(error))
+        finally:
+            events_manager.stop()
+            events_manager.unsubscribe(self.publish)
+            self.stopped.emit()
@@ -0,0 +1,381 @@
+import mimetypes
+import os
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from DownloadScheduler import DownloadScheduler
+from Drive import EXTENSIONS, FILE_FIELDS, FOLDER_TYPE, MIMETYPES
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+# files up to this size are sent in one multipart request, larger files with a resumable upload
+SIMPLE_UPLOAD_SIZE = 5 * 1024 * 1024
+
+# exported extension to the Google document type it is converted back to
+GOOGLE_TYPES = {extension: mime_type for mime_type, extension in EXTENSIONS.items()}
+
+
+def is_temporary(path):
+    """
+    Check if a file is temporary: partial downloads, settings being written, office lock files.
+    :param path: local path.
+    :return: True if it is never uploaded, False otherwise.
+    """
+    name = os.path.basename(path)
+    return name.startswith((".", "~$")) or name.endswith((".part", ".tmp"))
+
+
+class LocalChangesHandler(FileSystemEventHandler):
+    def __init__(self, pipeline):
+        """
+        Forward the filesystem events of the watched directory to the upload pipeline.
+        :param pipeline: UploadPipeline.
+        """
+        super(LocalChangesHandler, self).__init__()
+        self.pipeline = pipeline
+
+    def on_created(self, event):
+        self.pipeline.queue(event.src_path, "upload")
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.pipeline.queue(event.src_path, "upload")
+
+    def on_moved(self, event):
+        self.pipeline.queue_move(event.src_path, event.dest_path)
+
+    def on_deleted(self, event):
+        self.pipeline.queue(event.src_path, "delete")
+
+
+class UploadPipeline:
+    def __init__(self, drive_client, debounce=2.0, workers=4):
+        """
+        Push local changes to Drive as they happen, without rescanning the directory.
+        Filesystem events are debounced per path, then moves and deletions are sent as batched metadata updates,
+        missing folders are created level by level in batches and files are uploaded on a worker pool.
+        Files whose content matches the index, e.g. files the sync just downloaded, are not uploaded back.
+        :param drive_client: Google Drive client, already built for the directory and Drive folder.
+        :param debounce: seconds without events on a path before it is uploaded.
+        :param workers: number of concurrent uploads.
+        """
+        self.drive_client = drive_client
+        self.debounce = debounce
+        self.uploads = DownloadScheduler(workers)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.observer = None
+        self.flusher = None
+        self.stop_flushing = threading.Event()
+
+    def start(self):
+        """
+        Start watching the local directory.
+        :return: True if started, False if watchdog is not installed.
+        """
+        if Observer is None:
+            print("watchdog is not installed, local changes are not uploaded.")
+            return False
+        self.observer = Observer()
+        self.observer.schedule(LocalChangesHandler(self), self.drive_client.local_directory, recursive=True)
+        self.observer.start()
+        self.stop_flushing.clear()
+        self.flusher = threading.Thread(target=self.flush_periodically, name="uploads", daemon=True)
+        self.flusher.start()
+        return True
+
+    def stop(self):
+        """
+        Stop watching, upload the pending changes and wait for the running uploads.
+        :return: None.
+        """
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+        if self.flusher is not None:
+            self.stop_flushing.set()
+            self.flusher.join()
+            self.flusher = None
+        self.flush(force=True)
+        self.uploads.shutdown()
+
+    def queue(self, path, action, destination=None):
+        """
+        Record a local change, a later change of the same path replaces it.
+        :param path: local path.
+        :param action: "upload", "delete" or "move".
+        :param destination: new path of a move.
+        :return: None.
+        """
+        if is_temporary(path):
+            return
+        with self.lock:
+            self.pending[path] = (action, destination, time.monotonic())
+
+    def queue_move(self, source, destination):
+        """
+        Record a local move or rename.
+        :param source: old local path.
+        :param destination: new local path.
+        :return: None.
+        """
+        if is_temporary(source):
+            # a download or an editor replacing the file, its content is checked against the index
+            self.queue(destination, "upload")
+            return
+        if is_temporary(destination):
+            self.queue(source, "delete")
+            return
+        with self.lock:
+            previous = self.pending.pop(source, None)
+        if previous is not None and previous[0] == "upload" and self.drive_client.index.find(source) is None:
+            # a new file renamed before it was uploaded
+            self.queue(destination, "upload")
+        else:
+            self.queue(source, "move", destination)
+
+    def flush_periodically(self):
+        while not self.stop_flushing.wait(self.debounce / 4):
+            self.flush()
+
+    def flush(self, force=False):
+        """
+        Apply the changes of the paths that were quiet for the debounce delay.
+        :param force: apply every pending change.
+        :return: None.
+        """
+        now = time.monotonic()
+        with self.lock:
+            ready = {path: change for path, change in self.pending.items()
+                     if force or now - change[2] >= self.debounce}
+            for path in ready:
+                del self.pending[path]
+        if not ready:
+            return
+
+        try:
+            uploads = [path for path, change in ready.items() if change[0] == "upload"]
+            uploads += self.apply_moves([(path, change[1]) for path, change in ready.items() if change[0] == "move"])
+            self.apply_deletes([path for path, change in ready.items() if change[0] == "delete"])
+            self.apply_uploads(uploads)
+        except Exception as error:
+            print('An error occurred: {}'.format(error))
+
+    def folder_id(self, path):
+        """
+        Get the Drive ID of a local folder through the index.
+        :param path: local path of the folder.
+        :return: folder ID or None if it is not on Drive yet.
+        """
+        if os.path.normpath(path) == os.path.normpath(self.drive_client.local_directory):
+            return self.drive_client.drive_id
+        entry = self.drive_client.index.find(path)
+        return entry['file_id'] if entry is not None else None
+
+    def ensure_folders(self, paths):
+        """
+        Create the local folders missing on Drive, one batch request per level of the tree.
+        :param paths: local paths of folders.
+        :return: None.
+        """
+        root = os.path.join(os.path.normpath(self.drive_client.local_directory), "")
+        missing = set()
+        for path in paths:
+            while path.startswith(root) and path not in missing and self.folder_id(path) is None:
+                missing.add(path)
+                path = os.path.dirname(path)
+
+        drive_service = self.drive_client.drive_service
+        for depth in sorted({path.count(os.sep) for path in missing}):
+            level = [path for path in missing if path.count(os.sep) == depth]
+            folders = self.drive_client.execute_batch({
+                path: drive_service.files().create(body={
+                    'name': os.path.basename(path),
+                    'mimeType': FOLDER_TYPE,
+                    'parents': [self.folder_id(os.path.dirname(path))],
+                }, fields="id, name, parents")
+                for path in level if self.folder_id(os.path.dirname(path)) is not None
+            })
+            for path, folder in folders.items():
+                self.drive_client.index.put(folder['id'], path, {'mimeType': FOLDER_TYPE})
+                self.drive_client.folder_cache.put_metadata(folder)
+                self.drive_client.events_manager.update("upload_folder", folder['name'], os.path.dirname(path))
+
+    @staticmethod
+    def outermost(paths):
+        """
+        Drop the paths under another path of the list, a folder move or deletion covers its content.
+        :param paths: local paths.
+        :return: outermost paths.
+        """
+        return [path for path in paths
+                if not any(path.startswith(os.path.join(other, "")) for other in paths if other != path)]
+
+    def apply_moves(self, moves):
+        """
+        Move or rename the moved local files and folders on Drive, with one batch request per round.
+        A move into the new path of another moved folder waits for the next round, once that folder is moved.
+        :param moves: (old path, new path) pairs.
+        :return: new paths of moved files that are not on Drive yet, to upload.
+        """
+        destinations = dict(moves)
+        remaining = self.outermost(list(destinations))
+        uploads = []
+        while remaining:
+            waiting = [source for source in remaining
+                       if any(destinations[source].startswith(os.path.join(destinations[other], ""))
+                              for other in remaining if other != source)]
+            if len(waiting) == len(remaining):
+                waiting = []
+            uploads += self.move_files([source for source in remaining if source not in waiting], destinations)
+            remaining = waiting
+        return uploads
+
+    def move_files(self, sources, destinations):
+        """
+        Send one batch request moving or renaming files and folders on Drive.
+        :param sources: old local paths.
+        :param destinations: new local path of each old path.
+        :return: new paths of moved files that are not on Drive yet.
+        """
+        self.ensure_folders({os.path.dirname(destinations[source]) for source in sources})
+
+        uploads = []
+        requests = {}
+        drive_service = self.drive_client.drive_service
+        for source in sources:
+            destination = destinations[source]
+            entry = self.drive_client.index.find(source)
+            if entry is None:
+                # already moved by the sync, or never uploaded
+                uploads.append(destination)
+                continue
+
+            name = os.path.basename(destination)
+            if entry['extension'] and name.endswith(entry['extension']):
+                name = name[:-len(entry['extension'])]
+            old_parent_id = self.folder_id(os.path.dirname(source))
+            new_parent_id = self.folder_id(os.path.dirname(destination))
+            parents = {}
+            if old_parent_id is not None and old_parent_id != new_parent_id:
+                parents = {'addParents': new_parent_id, 'removeParents': old_parent_id}
+            requests[source] = drive_service.files().update(fileId=entry['file_id'], body={'name': name},
+                                                            fields="id, name, parents", **parents)
+
+        for source, file_metadata in self.drive_client.execute_batch(requests).items():
+            destination = destinations[source]
+            self.drive_client.index.move_tree(source, destination)
+            if os.path.isdir(destination):
+                self.drive_client.folder_cache.put_metadata(file_metadata)
+            self.drive_client.events_manager.update("upload_move", os.path.basename(source),
+                                                    os.path.dirname(source), destination)
+        return uploads
+
+    def apply_deletes(self, paths):
+        """
+        Trash the deleted local files and folders on Drive, with one batch request.
+        :param paths: local paths.
+        :return: None.
+        """
+        entries = {path: self.drive_client.index.find(path) for path in self.outermost(paths)}
+        requests = {
+            path: self.drive_client.drive_service.files().update(fileId=entry['file_id'], body={'trashed': True},
+                                                                 fields="id")
+            for path, entry in entries.items() if entry is not None and not os.path.exists(path)
+        }
+        for path, file_metadata in self.drive_client.execute_batch(requests).items():
+            self.drive_client.index.remove_tree(path)
+            self.drive_client.folder_cache.invalidate(file_metadata['id'])
+            self.drive_client.events_manager.update("upload_delete", os.path.basename(path), os.path.dirname(path))
+
+    def apply_uploads(self, paths):
+        """
+        Create the new local folders on Drive and schedule the uploads of the new and changed files.
+        :param paths: local paths.
+        :return: None.
+        """
+        sync_filter = self.drive_client.sync_filter
+        relative_path = self.drive_client.relative_path
+        files = [path for path in set(paths) if os.path.isfile(path) and not is_temporary(path) and
+                 not sync_filter.is_excluded(relative_path(path), mimetypes.guess_type(path)[0],
+                                             os.path.getsize(path))]
+        folders = [path for path in set(paths) if os.path.isdir(path) and
+                   not sync_filter.is_pruned(relative_path(path))]
+        self.ensure_folders(folders + [os.path.dirname(path) for path in files])
+
+        for path in files:
+            entry = self.drive_client.index.find(path)
+            if entry is not None and entry['md5_checksum'] == self.drive_client.compute_md5(path):
+                continue
+            self.uploads.submit(path, self.upload_file, path, entry)
+
+    def upload_file(self, path, entry):
+        """
+        Upload a new or changed file, runs on an upload worker.
+        Exported documents are converted back to their Google type, large files use a resumable upload.
+        :param path: local path.
+        :param entry: index entry of the file, None for a new file.
+        :return: None.
+        """
+        from googleapiclient.http import MediaFileUpload
+
+        media = None
+        try:
+            name = os.path.basename(path)
+            base_name, extension = os.path.splitext(name)
+            if entry is not None:
+                google_type = entry['mime_type'] if entry['mime_type'] in MIMETYPES else None
+            else:
+                google_type = GOOGLE_TYPES.get(extension)
+            if google_type is not None:
+                name = base_name
+                media_type = MIMETYPES[google_type]
+            else:
+                media_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+            size = os.path.getsize(path)
+            md5_checksum = self.drive_client.compute_md5(path)
+            media = MediaFileUpload(path, mimetype=media_type, chunksize=self.drive_client.chunk_size,
+                                    resumable=size > SIMPLE_UPLOAD_SIZE)
+            if entry is None:
+                parent_id = self.folder_id(os.path.dirname(path))
+                if parent_id is None:
+                    return
+                body = {'name': name, 'parents': [parent_id]}
+                if google_type is not None:
+                    body['mimeType'] = google_type
+                request = self.drive_client.drive_service.files().create(body=body, media_body=media,
+                                                                         fields=FILE_FIELDS)
+            else:
+                request = self.drive_client.drive_service.files().update(fileId=entry['file_id'], media_body=media,
+                                                                         fields=FILE_FIELDS)
+            self.drive_client.with_thread_http(request)
+
+            requests = self.drive_client.requests
+            if media.resumable():
+                file_metadata = None
+                while file_metadata is None:
+                    _, file_metadata = requests.execute(request.next_chunk, "api.upload_chunk")
+            else:
+                file_metadata = requests.execute(request.execute, "api.upload")
+            self.drive_client.metrics.count("bytes_uploaded", size)
+
+            # converted documents are indexed with the local checksum, like downloaded exports
+            if google_type is not None:
+                file_metadata['md5Checksum'] = md5_checksum
+            self.drive_client.index.put(file_metadata['id'], path, file_metadata, EXTENSIONS.get(google_type, ""))
+            self.drive_client.events_manager.update("upload", os.path.basename(path), os.path.dirname(path))
+
+        except (HttpError, OSError) as error:
+            print('An error occurred: {}'.format(error))
+        finally:
+            if media is not None:
+                media.stream().close()